@@ -0,0 +1,269 @@
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import repeat
+
+import numpy as np
+
+from random_streams import get_history_rngs, CounterStream, SobolStream
+from simulation import BATCH_SIZE, get_batch_sizes
+
+# Histories are always split in chunks of CHUNK_SIZE, whatever the number of workers, and every chunk gets its own
+# stream spawned from the master seed. The same seed therefore gives the same tallies on 1 or 64 workers.
+CHUNK_SIZE = BATCH_SIZE
+MASTER_SEED = 20241018
+# Chunks of the quasi-Monte Carlo sweeps: Sobol points are best balanced in powers of 2
+QMC_CHUNK_SIZE = 2 ** 16
+# Seconds between two checkpoints of an adaptive campaign
+CHECKPOINT_INTERVAL = 300
+
+# When an adaptive campaign stops: worst relative error of the scored bins, figure of merit 1 / (R^2 T), wall-clock
+# time budget in seconds and maximum number of histories. Any of them may be None, the first one met stops the run.
+CampaignTarget = namedtuple("CampaignTarget", ["relative_error", "figure_of_merit", "time_budget", "max_simulations"],
+                            defaults=[None, None, None, None])
+
+
+def get_chunk_seed_sequences(seed, num_chunks):
+    return np.random.SeedSequence(seed).spawn(num_chunks)
+
+
+def run_chunk(simulate_chunk, chunk_size, seed_sequence):
+    return simulate_chunk(chunk_size, np.random.default_rng(seed_sequence))
+
+
+def run_history_chunk(score_history, first_history, chunk_size, seed):
+    return merge_chunk_tallies(score_history(rng) for rng in get_history_rngs(seed, first_history, chunk_size))
+
+
+def map_tallies(function, *tallies):
+    if isinstance(tallies[0], (list, tuple)):
+        return type(tallies[0])(map_tallies(function, *items) for items in zip(*tallies))
+    return function(*tallies)
+
+
+def subtract_tallies(tally, reference):
+    # Histogram tallies are compared on their summed scores
+    return getattr(tally, "sums", tally) - getattr(reference, "sums", reference)
+
+
+def merge_tallies(total, tally):
+    if total is None:
+        return tally
+    return map_tallies(lambda a, b: a + b, total, tally)
+
+
+def run_campaign(simulate_chunk, num_simulations, seed=MASTER_SEED, num_workers=None, chunk_size=CHUNK_SIZE):
+    # simulate_chunk(num_simulations, rng) must be picklable (top level function or functools.partial of one) and
+    # return a tally that supports +, or a list/tuple of them.
+    chunk_sizes = list(get_batch_sizes(num_simulations, chunk_size))
+    seed_sequences = get_chunk_seed_sequences(seed, len(chunk_sizes))
+    return run_chunks(run_chunk, num_workers, len(chunk_sizes), repeat(simulate_chunk), chunk_sizes, seed_sequences)
+
+
+def run_history_campaign(score_history, num_simulations, seed=MASTER_SEED, num_workers=None, chunk_size=CHUNK_SIZE):
+    # For the per-history engines: score_history(rng) runs one history on its own counter-based stream, so any
+    # history of the campaign can be replayed alone with random_streams.replay_history(..., seed, history_index).
+    chunk_sizes = list(get_batch_sizes(num_simulations, chunk_size))
+    first_histories = range(0, num_simulations, chunk_size)
+    return run_chunks(run_history_chunk, num_workers, len(chunk_sizes), repeat(score_history), first_histories,
+                      chunk_sizes, repeat(seed))
+
+
+def get_sweep_stream(sampling, seed, first_history):
+    # "PSEUDO": counter-based uniforms, "QMC": randomized quasi-Monte Carlo, an independent scrambling per chunk
+    if sampling == "PSEUDO":
+        return CounterStream(seed, first_history)
+    elif sampling == "QMC":
+        return SobolStream(seed, first_history)
+    raise ValueError(f"Unknown sampling {sampling}")
+
+
+def run_sweep_chunk(simulate_chunk, configurations, first_history, chunk_size, seed, sampling="PSEUDO"):
+    # Every configuration sees the same random numbers, history by history
+    tallies = [simulate_chunk(chunk_size, get_sweep_stream(sampling, seed, first_history), **configuration)
+               for configuration in configurations]
+    if sampling == "QMC":
+        # The histories of a chunk are not independent, its tallies are one sample each
+        tallies = [map_tallies(lambda tally: tally.make_batch(), width_tallies) for width_tallies in tallies]
+    differences = [map_tallies(subtract_tallies, tally, tallies[0]) for tally in tallies[1:]]
+    squared_differences = [map_tallies(np.square, difference) for difference in differences]
+    return [tallies, differences, squared_differences]
+
+
+def run_sweep(simulate_chunk, configurations, num_simulations, seed=MASTER_SEED, num_workers=None,
+              chunk_size=CHUNK_SIZE, sampling="PSEUDO"):
+    # Correlated sampling over a list of configurations, e.g. [{"water_width": 5}, {"water_width": 10}].
+    # simulate_chunk(num_simulations, rng, **configuration) runs a batch engine on a CounterStream, or a SobolStream
+    # with sampling="QMC" (use chunk_size=QMC_CHUNK_SIZE).
+    # Returns the tallies of every configuration, the differences of configurations 1.. to configuration 0, and the
+    # standard error of those differences estimated from the spread between chunks.
+    chunk_sizes = list(get_batch_sizes(num_simulations, chunk_size))
+    first_histories = range(0, num_simulations, chunk_size)
+    tallies, differences, squared_differences = run_chunks(run_sweep_chunk, num_workers, len(chunk_sizes),
+                                                           repeat(simulate_chunk), repeat(configurations),
+                                                           first_histories, chunk_sizes, repeat(seed),
+                                                           repeat(sampling))
+    return tallies, differences, get_difference_errors(differences, squared_differences, len(chunk_sizes))
+
+
+def get_difference_errors(differences, squared_differences, num_chunks):
+    return map_tallies(lambda difference, squared: get_sum_standard_error(difference, squared, num_chunks),
+                       differences, squared_differences)
+
+
+def get_max_relative_error(tallies):
+    # Bins that never scored are left out, a bin scored by a single history is at 100%
+    if isinstance(tallies, (list, tuple)):
+        return max(get_max_relative_error(tally) for tally in tallies)
+    relative_error = tallies.get_relative_error()
+    return np.nanmax(relative_error) if np.any(np.isfinite(relative_error)) else np.inf
+
+
+def get_figure_of_merit(max_relative_error, elapsed_time):
+    # Expected value tallies can have no variance at all
+    return 1 / (max_relative_error ** 2 * elapsed_time) if max_relative_error > 0 else np.inf
+
+
+def is_target_met(target, max_relative_error, elapsed_time, num_simulations):
+    figure_of_merit = get_figure_of_merit(max_relative_error, elapsed_time)
+    return ((target.relative_error is not None and max_relative_error <= target.relative_error)
+            or (target.figure_of_merit is not None and figure_of_merit >= target.figure_of_merit)
+            or (target.time_budget is not None and elapsed_time >= target.time_budget)
+            or (target.max_simulations is not None and num_simulations >= target.max_simulations))
+
+
+def run_adaptive_chunks(run_function, get_chunk_arguments, target, num_workers, chunk_size, select_tallies,
+                        previous=None, checkpoint=None, previous_elapsed_time=None):
+    # Runs rounds of one chunk per worker until the target is met. Chunk i always gets the same stream, so a run that
+    # stops after n chunks gives the same tallies as a fixed campaign of n chunks, and error and history targets stop
+    # after the same chunk on any number of workers.
+    # previous: (tallies, number of histories) of an earlier run of the same campaign, topped up with the chunks that
+    # follow it. The time budget and the figure of merit only count the time of this run.
+    # checkpoint(tallies, number of histories, elapsed time) is called with the running totals every
+    # CHECKPOINT_INTERVAL seconds and on a keyboard interrupt. Passed back as previous and previous_elapsed_time they
+    # resume the campaign, with the same streams and its clock going on from the elapsed time.
+    if all(value is None for value in target):
+        raise ValueError("The campaign target needs at least one stopping criterion")
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    start_time = time.perf_counter() - (previous_elapsed_time or 0.0)
+    total, num_simulations = previous if previous is not None else (None, 0)
+    if num_simulations % chunk_size:
+        raise ValueError(f"{num_simulations} histories are not a number of chunks of {chunk_size}")
+    num_chunks = num_simulations // chunk_size
+    if previous is not None:
+        max_relative_error = get_max_relative_error(select_tallies(total))
+        if previous_elapsed_time is not None:
+            already_met = is_target_met(target, max_relative_error, previous_elapsed_time, num_simulations)
+        else:
+            # Only the criteria that do not depend on the time of this run
+            already_met = is_target_met(target._replace(figure_of_merit=None, time_budget=None), max_relative_error,
+                                        np.inf, num_simulations)
+        if already_met:
+            print(f"Campaign already at target after {num_simulations} histories, max relative error "
+                  f"{max_relative_error:.2%}")
+            return previous
+    previous_num_simulations = num_simulations
+    checkpoint_time = start_time
+    with ProcessPoolExecutor(num_workers) if num_workers > 1 else nullcontext() as executor:
+        map_chunks = executor.map if executor else map
+        try:
+            target_met = False
+            while not target_met:
+                round_chunks = range(num_chunks, num_chunks + num_workers)
+                if target.max_simulations is not None:
+                    round_chunks = range(num_chunks, min(round_chunks.stop, -(-target.max_simulations // chunk_size)))
+                for tally in map_chunks(run_function, *zip(*map(get_chunk_arguments, round_chunks))):
+                    # Chunks are merged and tested in order, the totals always hold chunks 0..num_chunks - 1. The
+                    # campaign stops at the first chunk that meets the target whatever the number of workers, the
+                    # chunks of the round after it are dropped.
+                    total = merge_tallies(total, tally)
+                    num_chunks += 1
+                    num_simulations = num_chunks * chunk_size
+                    elapsed_time = time.perf_counter() - start_time
+                    max_relative_error = get_max_relative_error(select_tallies(total))
+                    target_met = is_target_met(target, max_relative_error, elapsed_time, num_simulations)
+                    if target_met:
+                        break
+                if (not target_met and checkpoint is not None
+                        and time.perf_counter() - checkpoint_time >= CHECKPOINT_INTERVAL):
+                    checkpoint(total, num_simulations, time.perf_counter() - start_time)
+                    checkpoint_time = time.perf_counter()
+        except KeyboardInterrupt:
+            if checkpoint is not None and num_chunks * chunk_size > previous_num_simulations:
+                checkpoint(total, num_chunks * chunk_size, time.perf_counter() - start_time)
+                print(f"Campaign interrupted, checkpoint after {num_chunks * chunk_size} histories")
+            raise
+
+    print(f"Campaign stopped after {num_simulations} histories ({num_simulations - previous_num_simulations} new) and "
+          f"{elapsed_time:.2f}s, max relative error {max_relative_error:.2%}, figure of merit "
+          f"{get_figure_of_merit(max_relative_error, elapsed_time):.3g}")
+    return total, num_simulations
+
+
+def run_adaptive_campaign(simulate_chunk, target, seed=MASTER_SEED, num_workers=None, chunk_size=CHUNK_SIZE,
+                          previous=None, checkpoint=None, previous_elapsed_time=None):
+    # Same as run_campaign, but runs histories until target (a CampaignTarget) is met. simulate_chunk must return
+    # HistogramTally objects, or a list/tuple of them. Returns the tallies and the number of histories used, which can
+    # be passed back as previous to add histories to them. checkpoint, previous_elapsed_time: see run_adaptive_chunks.
+    def get_chunk_arguments(chunk_index):
+        return simulate_chunk, chunk_size, np.random.SeedSequence(seed, spawn_key=(chunk_index,))
+
+    return run_adaptive_chunks(run_chunk, get_chunk_arguments, target, num_workers, chunk_size,
+                               lambda tallies: tallies, previous, checkpoint, previous_elapsed_time)
+
+
+def run_adaptive_sweep_totals(simulate_chunk, configurations, target, seed=MASTER_SEED, num_workers=None,
+                              chunk_size=CHUNK_SIZE, sampling="PSEUDO", previous=None, checkpoint=None,
+                              previous_elapsed_time=None):
+    # run_adaptive_sweep before the standard errors: returns the summed tallies, differences and squared differences
+    # of the chunks, and the number of histories used. Pass them back as previous to add histories to them.
+    # checkpoint, previous_elapsed_time: see run_adaptive_chunks.
+    def get_chunk_arguments(chunk_index):
+        return simulate_chunk, configurations, chunk_index * chunk_size, chunk_size, seed, sampling
+
+    return run_adaptive_chunks(run_sweep_chunk, get_chunk_arguments, target, num_workers, chunk_size,
+                               lambda sweep_tallies: sweep_tallies[0], previous, checkpoint, previous_elapsed_time)
+
+
+def get_sweep_results(sweep_totals, num_simulations, chunk_size=CHUNK_SIZE):
+    tallies, differences, squared_differences = sweep_totals
+    difference_errors = get_difference_errors(differences, squared_differences, num_simulations // chunk_size)
+    return tallies, differences, difference_errors, num_simulations
+
+
+def run_adaptive_sweep(simulate_chunk, configurations, target, seed=MASTER_SEED, num_workers=None,
+                       chunk_size=CHUNK_SIZE, sampling="PSEUDO"):
+    # Same as run_sweep, until the tallies of every configuration meet target. Returns the tallies, the differences,
+    # their standard errors and the number of histories used.
+    sweep_totals, num_simulations = run_adaptive_sweep_totals(simulate_chunk, configurations, target, seed,
+                                                              num_workers, chunk_size, sampling)
+    return get_sweep_results(sweep_totals, num_simulations, chunk_size)
+
+
+def get_sum_standard_error(total, squared_total, num_batches):
+    if num_batches < 2:
+        return np.full(np.shape(total), np.nan)
+    batch_variance = (squared_total - total ** 2 / num_batches) / (num_batches - 1)
+    return np.sqrt(np.maximum(batch_variance, 0) * num_batches)
+
+
+def run_chunks(run_function, num_workers, num_chunks, *chunk_arguments):
+    if num_workers is None:
+        num_workers = min(os.cpu_count() or 1, num_chunks)
+
+    if num_workers <= 1:
+        return merge_chunk_tallies(map(run_function, *chunk_arguments))
+    with ProcessPoolExecutor(num_workers) as executor:
+        # map keeps chunk order, so tallies are always merged in the same order
+        return merge_chunk_tallies(executor.map(run_function, *chunk_arguments))
+
+
+def merge_chunk_tallies(chunk_tallies):
+    total = None
+    for tally in chunk_tallies:
+        total = merge_tallies(total, tally)
+    return total
@@ -0,0 +1,128 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from geometry import CrossSections
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# Energy of a neutron of unitless speed 1, the 1MeV source
+SOURCE_ENERGY = 10 ** 6  # eV
+
+# Pointwise microscopic cross sections in barns, energies in eV
+Nuclide = namedtuple("Nuclide", ["name", "mass", "energies", "elastic", "capture"])
+# Number densities in atoms per barn-cm, so number density * microscopic cross section is in cm-1
+EnergyMaterial = namedtuple("EnergyMaterial", ["name", "nuclides", "number_densities"])
+# Position of a batch of energies on the union grid: the interval below each energy and how far into it
+GridIndex = namedtuple("GridIndex", ["indices", "fractions"])
+
+
+def load_nuclide(name, mass, data_directory=DATA_DIRECTORY):
+    # Data files: one line per energy, energy (eV), elastic (b), capture (b), lines starting with # are comments
+    energies, elastic, capture = np.loadtxt(os.path.join(data_directory, f"{name}.txt"), unpack=True)
+    return Nuclide(name, mass, energies, elastic, capture)
+
+
+def get_union_grid(nuclides):
+    return np.unique(np.concatenate([nuclide.energies for nuclide in nuclides]))
+
+
+def select_grid_index(grid_index, selection):
+    # Constant cross section tables have no grid index
+    if grid_index is None:
+        return None
+    return GridIndex(grid_index.indices[selection], grid_index.fractions[selection])
+
+
+class EnergyMaterialTable:
+    # Same interface as materials.MaterialTable, with cross sections that depend on the neutron energy. Every
+    # nuclide is interpolated (lin-lin) once onto the union of all the nuclide grids, and the macroscopic cross
+    # sections of every material are summed on that grid. locate_energies then costs one binary search per flight,
+    # and the same index gives every material and nuclide cross section at that energy. Energies outside the grid
+    # use the value at its closest end.
+
+    def __init__(self, materials):
+        nuclides = list({nuclide.name: nuclide for material in materials for nuclide in material.nuclides}.values())
+        self.energies = get_union_grid(nuclides)
+        self.names = [material.name for material in materials]
+        self.ids = {name: material_id for material_id, name in enumerate(self.names)}
+
+        # Macroscopic scattering of every nuclide of every material, padded to the largest composition:
+        # (materials, nuclides, grid)
+        max_nuclides = max(len(material.nuclides) for material in materials)
+        self.nuclide_masses = np.zeros((len(materials), max_nuclides))
+        nuclide_scattering = np.zeros((len(materials), max_nuclides, self.energies.size))
+        absorption = np.zeros((len(materials), self.energies.size))
+        for material_id, material in enumerate(materials):
+            for nuclide_index, (nuclide, number_density) in enumerate(zip(material.nuclides,
+                                                                          material.number_densities)):
+                self.nuclide_masses[material_id, nuclide_index] = nuclide.mass
+                nuclide_scattering[material_id, nuclide_index] = number_density * np.interp(
+                    self.energies, nuclide.energies, nuclide.elastic)
+                absorption[material_id] += number_density * np.interp(self.energies, nuclide.energies,
+                                                                      nuclide.capture)
+        scattering = nuclide_scattering.sum(axis=1)
+
+        # Values and slopes per grid interval, interpolating is then one multiply-add
+        self.scattering_cross_sections = scattering
+        self.absorption_cross_sections = absorption
+        self.total_cross_sections = scattering + absorption
+        self.cumulative_scattering = np.cumsum(nuclide_scattering, axis=1)
+        self.scattering_differences = self.get_differences(scattering)
+        self.absorption_differences = self.get_differences(absorption)
+        self.total_differences = self.get_differences(self.total_cross_sections)
+        self.cumulative_scattering_differences = self.get_differences(self.cumulative_scattering)
+
+    def get_differences(self, table):
+        return np.diff(table, axis=-1, append=table[..., -1:])
+
+    def get_id(self, name):
+        return self.ids[name]
+
+    def locate_energies(self, energies):
+        indices = np.clip(np.searchsorted(self.energies, energies, side="right") - 1, 0, self.energies.size - 2)
+        lower_energies = self.energies[indices]
+        fractions = np.clip((energies - lower_energies) / (self.energies[indices + 1] - lower_energies), 0, 1)
+        return GridIndex(indices, fractions)
+
+    def interpolate(self, table, differences, material_ids, grid_index):
+        # material_ids has the shape of the grid index, or one more axis, e.g. every region of the geometry for
+        # every neutron
+        indices, fractions = grid_index
+        if np.ndim(material_ids) > indices.ndim:
+            indices, fractions = indices[:, None], fractions[:, None]
+        return table[material_ids, indices] + fractions * differences[material_ids, indices]
+
+    def get_total_cross_sections(self, material_ids, grid_index):
+        return self.interpolate(self.total_cross_sections, self.total_differences, material_ids, grid_index)
+
+    def get_scattering_cross_sections(self, material_ids, grid_index):
+        return self.interpolate(self.scattering_cross_sections, self.scattering_differences, material_ids,
+                                grid_index)
+
+    def get_cross_sections(self, material_id, energy):
+        grid_index = self.locate_energies(np.array([energy], dtype=float))
+        material_ids = np.array([material_id])
+        return CrossSections(
+            self.get_total_cross_sections(material_ids, grid_index)[0],
+            self.get_scattering_cross_sections(material_ids, grid_index)[0],
+            self.interpolate(self.absorption_cross_sections, self.absorption_differences, material_ids,
+                             grid_index)[0])
+
+    def sample_nuclide_masses(self, material_ids, uniforms, grid_index):
+        # Target nucleus in proportion to the macroscopic scattering cross section of every nuclide at the energy
+        indices, fractions = grid_index
+        cumulative_scattering = self.cumulative_scattering[material_ids, :, indices] \
+            + fractions[:, None] * self.cumulative_scattering_differences[material_ids, :, indices]
+        nuclide_indices = np.sum(uniforms[:, None] * cumulative_scattering[:, -1:] >= cumulative_scattering, axis=-1)
+        return self.nuclide_masses[material_ids, np.minimum(nuclide_indices, self.nuclide_masses.shape[1] - 1)]
+
+    def get_absorption_ratios(self, material_ids, grid_index):
+        absorption = self.interpolate(self.absorption_cross_sections, self.absorption_differences, material_ids,
+                                      grid_index)
+        return absorption / self.get_total_cross_sections(material_ids, grid_index)
+
+    def are_absorbed(self, material_ids, uniforms, grid_index):
+        absorption = self.interpolate(self.absorption_cross_sections, self.absorption_differences, material_ids,
+                                      grid_index)
+        return uniforms * self.get_total_cross_sections(material_ids, grid_index) < absorption
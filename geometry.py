@@ -0,0 +1,162 @@
+import bisect
+import math
+from collections import namedtuple
+
+import numpy as np
+
+# Material ID 0 is the void around the stack
+VOID = 0
+
+# Macroscopic cross sections of a layer, in cm-1
+CrossSections = namedtuple("CrossSections", ["total", "scattering", "absorption"])
+VOID_CROSS_SECTIONS = CrossSections(0.0, 0.0, 0.0)
+# thickness in cm. importance: weight of the layer for geometry splitting, see
+# variance_reduction.get_importance_split_counts
+Layer = namedtuple("Layer", ["material", "thickness", "cross_sections", "importance"], defaults=[1.0])
+
+
+class SlabGeometry:
+    # A stack of slabs along x, starting at left. Regions are numbered from the left: 0 is the void before the stack,
+    # 1..N the layers and N + 1 the void after it. A point on a boundary belongs to the region on its right.
+
+    def __init__(self, layers, left=0.0):
+        self.layers = list(layers)
+        self.boundaries = left + np.concatenate(([0.0], np.cumsum([layer.thickness for layer in self.layers])))
+        self.left = self.boundaries[0]
+        self.right = self.boundaries[-1]
+        region_cross_sections = [VOID_CROSS_SECTIONS] + [layer.cross_sections for layer in self.layers] \
+            + [VOID_CROSS_SECTIONS]
+        self.materials = np.array([VOID] + [layer.material for layer in self.layers] + [VOID])
+        self.total_cross_sections = np.array([cross_sections.total for cross_sections in region_cross_sections])
+        self.scattering_cross_sections = np.array([cross_sections.scattering
+                                                   for cross_sections in region_cross_sections])
+        self.absorption_cross_sections = np.array([cross_sections.absorption
+                                                   for cross_sections in region_cross_sections])
+        # The voids never see a neutron come back, their importance is 1
+        self.importances = np.array([1.0] + [layer.importance for layer in self.layers] + [1.0])
+        self.num_regions = len(self.layers) + 2
+        self.majorant_cross_section = self.total_cross_sections.max()
+        # Plain lists for the per-history engines, see materials.MaterialTable
+        self.boundary_list = self.boundaries.tolist()
+        self.material_list = self.materials.tolist()
+        self.total_cross_section_list = self.total_cross_sections.tolist()
+
+    def get_regions(self, positions_x):
+        # Works for a single x or an array of them
+        return np.searchsorted(self.boundaries, positions_x, side="right")
+
+    def get_region(self, position_x):
+        return bisect.bisect_right(self.boundary_list, position_x)
+
+    def get_materials(self, positions_x):
+        return self.materials[self.get_regions(positions_x)]
+
+    def is_void(self, regions):
+        return (regions == 0) | (regions == self.num_regions - 1)
+
+    def is_outside(self, positions_x):
+        return (positions_x < self.left) | (positions_x > self.right)
+
+    def get_distances_to_boundary(self, positions_x, directions_x, regions=None):
+        # Distance along the flight to the next boundary in the direction of travel, inf when flying parallel to the
+        # boundaries or out to the void. Works for scalars and arrays.
+        if regions is None:
+            regions = self.get_regions(positions_x)
+        boundary_indices = np.clip(np.where(directions_x > 0, regions, regions - 1), 0, self.num_regions - 2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distances = (self.boundaries[boundary_indices] - positions_x) / directions_x
+        leaving = ((regions == 0) & (directions_x <= 0)) | ((regions == self.num_regions - 1) & (directions_x >= 0))
+        return np.where((directions_x == 0) | leaving, np.inf, np.maximum(distances, 0))
+
+    def get_flight_distances(self, positions_x, directions_x, optical_depths, total_cross_sections=None):
+        # Surface tracking: the distance covered by every flight of the given optical depth (-log r), crossing as
+        # many boundaries as needed. Flights leaving the stack go on with the cross section of the last layer.
+        # total_cross_sections: optional (flights, regions) cross sections of every region for every flight, for
+        # energy dependent cross sections
+        positions_x = np.array(positions_x, dtype=float)
+        regions = self.get_regions(positions_x)
+        remaining = np.array(optical_depths, dtype=float)
+        flight_distances = np.zeros_like(remaining)
+
+        flying = np.flatnonzero(~self.is_void(regions))
+        while flying.size:
+            flight_regions = regions[flying]
+            if total_cross_sections is None:
+                cross_sections = self.total_cross_sections[flight_regions]
+            else:
+                cross_sections = total_cross_sections[flying, flight_regions]
+            distances_to_boundary = self.get_distances_to_boundary(positions_x[flying], directions_x[flying],
+                                                                   flight_regions)
+            boundary_depths = cross_sections * distances_to_boundary
+            collided = remaining[flying] < boundary_depths
+            with np.errstate(divide="ignore", invalid="ignore"):
+                distances = np.where(collided, remaining[flying] / cross_sections, distances_to_boundary)
+            flight_distances[flying] += distances
+            positions_x[flying] += distances * directions_x[flying]
+            remaining[flying] -= np.where(collided, remaining[flying], boundary_depths)
+
+            crossing = flying[~collided]
+            regions[crossing] += np.where(directions_x[crossing] > 0, 1, -1)
+            escaped = self.is_void(regions[crossing])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                flight_distances[crossing[escaped]] += remaining[crossing[escaped]] / cross_sections[~collided][escaped]
+            flying = crossing[~escaped]
+        return flight_distances
+
+    def get_flight_distance(self, position_x, direction_x, optical_depth):
+        # Same as get_flight_distances for a single neutron, a neutron in the voids is not flown
+        region = self.get_region(position_x)
+        flight_distance = 0.0
+        if region == 0 or region == self.num_regions - 1:
+            return flight_distance
+        while True:
+            cross_section = self.total_cross_section_list[region]
+            if direction_x == 0:
+                distance_to_boundary = math.inf
+            else:
+                # Region r lies between boundaries r - 1 and r
+                boundary_index = region if direction_x > 0 else region - 1
+                distance_to_boundary = (self.boundary_list[boundary_index] - position_x) / direction_x
+            if optical_depth < cross_section * distance_to_boundary:
+                return flight_distance + optical_depth / cross_section
+
+            flight_distance += distance_to_boundary
+            position_x += distance_to_boundary * direction_x
+            optical_depth -= cross_section * distance_to_boundary
+            region += 1 if direction_x > 0 else -1
+            if region == 0 or region == self.num_regions - 1:
+                return flight_distance + optical_depth / cross_section
+
+    def get_uncollided_track_lengths(self, position_x, direction_x, bin_edges, total_cross_sections=None):
+        # Expected track length, before its first collision, of a neutron starting at position_x in every bin along x:
+        # the integral of exp(-optical depth) along its flight, bin by bin. Times the cross section of the bin this is
+        # the chance that its first collision happens there. total_cross_sections: optional cross sections of
+        # every region for this neutron.
+        if total_cross_sections is None:
+            total_cross_sections = self.total_cross_sections
+        bin_edges = np.asarray(bin_edges, dtype=float)
+        track_lengths = np.zeros(bin_edges.size - 1)
+        if direction_x == 0:
+            # Flying parallel to the faces, the whole flight stays at position_x
+            bin_index = np.searchsorted(bin_edges, position_x, side="right") - 1
+            cross_section = total_cross_sections[self.get_region(position_x)]
+            if 0 <= bin_index < track_lengths.size:
+                track_lengths[bin_index] = 1 / cross_section if cross_section > 0 else math.inf
+            return track_lengths
+
+        # Flight cut at every bin edge and region boundary ahead of the neutron, the cross section is constant on
+        # every piece
+        points_x = np.concatenate((bin_edges, self.boundaries))
+        distances = np.unique(np.append((points_x - position_x) / direction_x, 0.0))
+        distances = distances[(distances >= 0) & (distances <= ((bin_edges[[0, -1]] - position_x) / direction_x).max())]
+        middles_x = position_x + (distances[:-1] + distances[1:]) / 2 * direction_x
+        piece_lengths = np.diff(distances)
+        cross_sections = total_cross_sections[self.get_regions(middles_x)]
+        optical_depths = np.concatenate(([0.0], np.cumsum(cross_sections * piece_lengths)))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            piece_track_lengths = np.where(cross_sections > 0,
+                                           -np.exp(-optical_depths[:-1]) * np.expm1(-cross_sections * piece_lengths)
+                                           / cross_sections, piece_lengths * np.exp(-optical_depths[:-1]))
+        bin_indices = np.searchsorted(bin_edges, middles_x, side="right") - 1
+        inside = (bin_indices >= 0) & (bin_indices < track_lengths.size)
+        return np.bincount(bin_indices[inside], piece_track_lengths[inside], track_lengths.size)
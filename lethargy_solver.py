@@ -0,0 +1,103 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from simulation_homogenous_media import MATERIALS, THERMALIZED_LETHARGY
+
+# Reference answers for the infinite-medium slowing down problem, without Monte Carlo. The lethargy from the source
+# to the thermal threshold is split in cells and the collision density is carried from one collision to the next with
+# the elastic scattering kernel, integrated exactly over the cells. The neutrons of a cell are taken uniform over it,
+# the error goes down with num_cells.
+NUM_CELLS = 4000
+# Collisions stop once the neutrons still slowing down are below this fraction of the source
+TOLERANCE = 1e-12
+
+# collision_probabilities[n]: chance to thermalize at collision n (0 for n = 0), absorbed neutrons never do.
+# absorption_probabilities[n]: chance to be absorbed at collision n. spectra[n - 1]: lethargy density, per unit
+# lethargy and source neutron, of the neutrons still above the threshold after collision n.
+SlowingDownSolution = namedtuple("SlowingDownSolution", ["lethargies", "collision_probabilities",
+                                                         "absorption_probabilities", "thermalization_probability",
+                                                         "mean_collisions", "spectra"])
+
+
+def get_lethargy_gain_cdf(gains, alpha):
+    # Isotropic CM scattering: E'/E uniform between alpha and 1, so the lethargy gain is below g with probability
+    # (1 - exp(-g)) / (1 - alpha), up to ln(1 / alpha)
+    max_gain = -math.log(alpha) if alpha > 0 else math.inf
+    gains = np.clip(gains, 0, max_gain)
+    return -np.expm1(-gains) / (1 - alpha)
+
+
+def get_integrated_lethargy_gain_cdf(gains, alpha):
+    # Integral of get_lethargy_gain_cdf from 0 to gains
+    max_gain = -math.log(alpha) if alpha > 0 else math.inf
+    gains = np.maximum(gains, 0)
+    clipped_gains = np.minimum(gains, max_gain)
+    return (clipped_gains + np.expm1(-clipped_gains)) / (1 - alpha) + (gains - clipped_gains)
+
+
+def get_scattering_kernels(medium, num_cells, cell_width):
+    # Chance to land offsets 0, 1, ... cells further in lethargy: from the source point (first collision) and from a
+    # neutron spread uniformly over its cell (every other collision), summed over the nuclides of the medium
+    material = MATERIALS.get_id(medium)
+    nuclide_probabilities = np.diff(MATERIALS.cumulative_probability_lists[material], prepend=0)
+    offsets = np.arange(num_cells) * cell_width
+    source_kernel = np.zeros(num_cells)
+    cell_kernel = np.zeros(num_cells)
+    for mass, probability in zip(MATERIALS.nuclide_mass_lists[material], nuclide_probabilities):
+        alpha = ((mass - 1) / (mass + 1)) ** 2
+        source_kernel += probability * np.diff(get_lethargy_gain_cdf(np.append(offsets, num_cells * cell_width),
+                                                                     alpha))
+        integrated_cdf = get_integrated_lethargy_gain_cdf(np.concatenate(([-cell_width], offsets,
+                                                                          [num_cells * cell_width])), alpha)
+        cell_kernel += probability * (integrated_cdf[2:] - 2 * integrated_cdf[1:-1] + integrated_cdf[:-2]) \
+            / cell_width
+    return source_kernel, cell_kernel
+
+
+def solve_slowing_down(medium, with_absorbance=False, num_spectra=8, num_cells=NUM_CELLS, tolerance=TOLERANCE):
+    # medium: name in simulation_homogenous_media.MATERIALS. Same physics as slow_down_batch: every collision is an
+    # absorption with the absorption ratio of the medium (with_absorbance) or an elastic scattering.
+    cell_width = THERMALIZED_LETHARGY / num_cells
+    lethargies = (np.arange(num_cells) + 0.5) * cell_width
+    source_kernel, cell_kernel = get_scattering_kernels(medium, num_cells, cell_width)
+    absorption_ratio = MATERIALS.absorption_ratio_list[MATERIALS.get_id(medium)] if with_absorbance else 0.0
+
+    # Every collision is a linear convolution with the cell kernel, done with FFTs
+    fft_size = 2 * num_cells
+    cell_kernel_fft = np.fft.rfft(cell_kernel, fft_size)
+
+    # Without absorption first: absorption does not depend on the energy, it only weights collision n by the
+    # chance (1 - absorption ratio)^n to get there
+    densities = source_kernel
+    thermalized = [0.0, 1 - densities.sum()]
+    spectra = [densities]
+    while densities.sum() > tolerance:
+        next_densities = np.fft.irfft(np.fft.rfft(densities, fft_size) * cell_kernel_fft, fft_size)[:num_cells]
+        next_densities = np.maximum(next_densities, 0)
+        thermalized.append(densities.sum() - next_densities.sum())
+        densities = next_densities
+        if len(spectra) < num_spectra:
+            spectra.append(densities)
+
+    collision_numbers = np.arange(len(thermalized))
+    survival_probabilities = (1 - absorption_ratio) ** collision_numbers
+    collision_probabilities = np.array(thermalized) * survival_probabilities
+    # Still slowing down before collision n, then absorbed at it
+    slowing_down = 1 - np.cumsum(thermalized)
+    absorption_probabilities = np.zeros_like(collision_probabilities)
+    absorption_probabilities[1:] = absorption_ratio * survival_probabilities[:-1] * slowing_down[:-1]
+    thermalization_probability = collision_probabilities.sum()
+    mean_collisions = np.sum(collision_numbers * collision_probabilities) / thermalization_probability
+    spectra = np.array(spectra[:num_spectra]) * survival_probabilities[1:len(spectra) + 1, None] / cell_width
+    return SlowingDownSolution(lethargies, collision_probabilities, absorption_probabilities,
+                               thermalization_probability, mean_collisions, spectra)
+
+
+def get_collision_number_moments(solution):
+    # Mean and standard deviation of the number of collisions of the thermalized neutrons
+    collision_numbers = np.arange(solution.collision_probabilities.size)
+    probabilities = solution.collision_probabilities / solution.thermalization_probability
+    mean = np.sum(collision_numbers * probabilities)
+    return mean, math.sqrt(np.sum((collision_numbers - mean) ** 2 * probabilities))
@@ -1,48 +1,94 @@
 import math
-import random
 import numpy as np
 from numpy.linalg import norm as get_norm
 
-def elastic_collision(v_0_LAB, mass_target):
+from variate_pool import default_pool
+
+def elastic_collision(v_0_LAB, mass_target, rng=default_pool):
     # Angle in CM frame
-    cos_theta_collision_CM = 2 * random.random() - 1
-    Acos = mass_target * cos_theta_collision_CM
-    common_numerator = mass_target + 1
-    to_be_squared = math.pow(mass_target, 2) - math.pow(Acos, 2)
-    
-    # LAB frame velocity components
-    parallel_factor = (Acos + 1) / common_numerator
-    perpendicular_factor = get_norm(v_0_LAB) * math.sqrt(to_be_squared) / common_numerator
-    v_f_perpendicular_LAB = normalize_vector(np.cross(v_0_LAB, get_random_vector()))
-    v_f_LAB = parallel_factor * v_0_LAB + perpendicular_factor * v_f_perpendicular_LAB
-    
-    # Calculate scattering angle in LAB
-    cos_theta_lab = np.dot(normalize_vector(v_0_LAB), normalize_vector(v_f_LAB))
+    cos_theta_collision_CM = 2 * rng.random() - 1
+    energy_ratio, cos_theta_lab = get_energy_ratio_and_cos_theta_lab(mass_target, cos_theta_collision_CM)
+
+    # LAB frame velocity, the direction turned by theta_lab around a random azimuth
+    speed_0 = get_norm(v_0_LAB)
+    direction = rotate_direction(v_0_LAB / speed_0, cos_theta_lab, 2 * math.pi * rng.random())
+    speed = speed_0 * math.sqrt(energy_ratio)
+    v_f_LAB = speed * direction
     theta_lab = math.acos(cos_theta_lab)
-    
+
     # Calulate particle energy after collision
-    energy = calculate_energy(v_f_LAB)
-    
+    energy = speed ** 2
+
     return v_f_LAB, theta_lab, energy
 
+
+def get_energy_ratio_and_cos_theta_lab(mass_target, cos_theta_collision_CM):
+    # Closed forms of elastic scattering: E'/E and the LAB cosine only depend on the target mass and the CM cosine
+    energy_factor = mass_target ** 2 + 2 * mass_target * cos_theta_collision_CM + 1
+    energy_ratio = energy_factor / (mass_target + 1) ** 2
+    if energy_factor == 0:
+        # Head-on collision with hydrogen, the neutron stops
+        return energy_ratio, 1.0
+    cos_theta_lab = (mass_target * cos_theta_collision_CM + 1) / math.sqrt(energy_factor)
+    return energy_ratio, min(max(cos_theta_lab, -1.0), 1.0)
+
+
+def rotate_direction(direction, cos_theta, phi):
+    # Direction cosines after a deflection of theta at azimuth phi
+    u, v, w = direction
+    sin_theta = math.sqrt(1 - cos_theta ** 2)
+    sin_theta_w = math.sqrt(max(1 - w ** 2, 0))
+    if sin_theta_w < 1e-10:
+        return np.array([sin_theta * math.cos(phi), sin_theta * math.sin(phi), cos_theta * math.copysign(1.0, w)])
+    a = sin_theta * math.cos(phi) / sin_theta_w
+    b = sin_theta * math.sin(phi) / sin_theta_w
+    return np.array([cos_theta * u + a * u * w - b * v,
+                     cos_theta * v + a * v * w + b * u,
+                     cos_theta * w - a * (1 - w ** 2)])
+
+
+def elastic_collision_batch(directions, speeds, mass_target, rng=np.random, uniforms=None):
+    # Same kinematics as elastic_collision for (N, 3) unit directions, (N,) speeds and (N,) target masses.
+    # uniforms, if given, is a (2, N) array (CM cosine, azimuth) used instead of drawing from rng.
+    # Returns the new directions and speeds and the LAB cosines.
+    mass_target = np.asarray(mass_target, dtype=float)
+    if uniforms is None:
+        uniforms = rng.random((2, speeds.size))
+
+    energy_ratios, cos_theta_lab = get_energy_ratios_and_cos_theta_lab(mass_target, 2 * uniforms[0] - 1)
+    directions = rotate_directions(directions, cos_theta_lab, 2 * np.pi * uniforms[1])
+    return directions, speeds * np.sqrt(energy_ratios), cos_theta_lab
+
+
+def get_energy_ratios_and_cos_theta_lab(mass_target, cos_theta_collision_CM):
+    energy_factors = mass_target ** 2 + 2 * mass_target * cos_theta_collision_CM + 1
+    energy_ratios = energy_factors / (mass_target + 1) ** 2
+    cos_theta_lab = np.divide(mass_target * cos_theta_collision_CM + 1, np.sqrt(energy_factors),
+                              out=np.ones_like(energy_factors), where=energy_factors > 0)
+    return energy_ratios, np.clip(cos_theta_lab, -1, 1)
+
+
+def rotate_directions(directions, cos_theta, phi):
+    u, v, w = directions.T
+    sin_theta = np.sqrt(1 - cos_theta ** 2)
+    sin_theta_w = np.sqrt(np.maximum(1 - w ** 2, 0))
+    # Directions along z need their own azimuth reference
+    along_z = sin_theta_w < 1e-10
+    a = sin_theta * np.cos(phi) / np.where(along_z, 1, sin_theta_w)
+    b = sin_theta * np.sin(phi) / np.where(along_z, 1, sin_theta_w)
+    rotated = np.column_stack((cos_theta * u + a * u * w - b * v,
+                               cos_theta * v + a * v * w + b * u,
+                               cos_theta * w - a * (1 - w ** 2)))
+    if along_z.any():
+        rotated[along_z] = np.column_stack((a[along_z], b[along_z], cos_theta[along_z] * np.sign(w[along_z])))
+    return rotated
+
 def normalize_vector(vector):
     norm = get_norm(vector)
     if norm == 0:
         return vector
     return vector / norm
 
-def get_random_vector():
-    random_cos_theta = 2 * random.random() - 1
-    random_sin_theta = math.sqrt(1 - math.pow(random_cos_theta, 2))
-    random_phi = 2 * math.pi * random.random()
-    random_cos_phi = math.cos(random_phi)
-    random_sin_phi = math.sin(random_phi)
-    random_vector = [
-        random_cos_phi * random_sin_theta,
-        random_sin_phi * random_sin_theta,
-        random_cos_theta
-    ]
-    return np.array(random_vector)
 
 def calculate_energy(velocity, mass_neutron=1):
-    return get_norm(velocity)**2
\ No newline at end of file
+    return get_norm(velocity)**2
@@ -0,0 +1,84 @@
+from collections import namedtuple
+
+import numpy as np
+
+from geometry import CrossSections
+
+# Macroscopic cross sections in cm-1. nuclide_masses in neutron masses, nuclide_fractions are the relative chances of
+# each nuclide being the target of a scattering.
+Material = namedtuple("Material", ["name", "total", "scattering", "absorption", "nuclide_masses",
+                                   "nuclide_fractions"])
+
+
+class MaterialTable:
+    # Compiled from a list of materials, the material ID is the position in that list. Every property is an array
+    # indexed by material ID, so a lookup is the same for one neutron or a whole batch. The per-history engines use
+    # the plain list copies, indexing numpy arrays one value at a time is slow.
+
+    def __init__(self, materials):
+        self.names = [material.name for material in materials]
+        self.ids = {name: material_id for material_id, name in enumerate(self.names)}
+        self.total_cross_sections = np.array([material.total for material in materials], dtype=float)
+        self.scattering_cross_sections = np.array([material.scattering for material in materials], dtype=float)
+        self.absorption_cross_sections = np.array([material.absorption for material in materials], dtype=float)
+        self.absorption_ratios = np.divide(self.absorption_cross_sections, self.total_cross_sections,
+                                           out=np.zeros(len(materials)), where=self.total_cross_sections > 0)
+
+        # Nuclides padded to the largest composition, the padding is never selected
+        max_nuclides = max(len(material.nuclide_masses) for material in materials)
+        self.nuclide_masses = np.zeros((len(materials), max_nuclides))
+        self.cumulative_probabilities = np.ones((len(materials), max_nuclides))
+        for material_id, material in enumerate(materials):
+            num_nuclides = len(material.nuclide_masses)
+            self.nuclide_masses[material_id, :num_nuclides] = material.nuclide_masses
+            if num_nuclides:
+                fractions = np.asarray(material.nuclide_fractions, dtype=float)
+                self.cumulative_probabilities[material_id, :num_nuclides] = np.cumsum(fractions) / fractions.sum()
+
+        self.total_cross_section_list = self.total_cross_sections.tolist()
+        self.absorption_ratio_list = self.absorption_ratios.tolist()
+        self.nuclide_mass_lists = [list(material.nuclide_masses) for material in materials]
+        self.cumulative_probability_lists = [self.cumulative_probabilities[material_id, :len(material.nuclide_masses)]
+                                             .tolist() for material_id, material in enumerate(materials)]
+
+    def get_id(self, name):
+        return self.ids[name]
+
+    def get_cross_sections(self, material_id):
+        return CrossSections(self.total_cross_sections[material_id], self.scattering_cross_sections[material_id],
+                             self.absorption_cross_sections[material_id])
+
+    # The batch lookups take the grid index of cross_sections.EnergyMaterialTable, constant cross sections have none
+    def locate_energies(self, energies):
+        return None
+
+    def get_total_cross_sections(self, material_ids, grid_index=None):
+        return self.total_cross_sections[material_ids]
+
+    def get_scattering_cross_sections(self, material_ids, grid_index=None):
+        return self.scattering_cross_sections[material_ids]
+
+    def get_absorption_ratios(self, material_ids, grid_index=None):
+        return self.absorption_ratios[material_ids]
+
+    def sample_nuclide_masses(self, material_ids, uniforms, grid_index=None):
+        nuclide_indices = np.sum(uniforms[..., None] >= self.cumulative_probabilities[material_ids], axis=-1)
+        return self.nuclide_masses[material_ids, np.minimum(nuclide_indices, self.nuclide_masses.shape[1] - 1)]
+
+    def are_absorbed(self, material_ids, uniforms, grid_index=None):
+        return uniforms < self.absorption_ratios[material_ids]
+
+    def sample_nuclide_mass(self, material_id, rng):
+        # Single nuclide materials do not use a random number
+        nuclide_masses = self.nuclide_mass_lists[material_id]
+        if len(nuclide_masses) == 1:
+            return nuclide_masses[0]
+        r = rng.random()
+        for nuclide_mass, cumulative_probability in zip(nuclide_masses,
+                                                        self.cumulative_probability_lists[material_id]):
+            if r < cumulative_probability:
+                return nuclide_mass
+        return nuclide_masses[-1]
+
+    def is_absorbed(self, material_id, rng):
+        return rng.random() < self.absorption_ratio_list[material_id]
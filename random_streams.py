@@ -0,0 +1,152 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from variate_pool import VariatePool
+
+# Philox is counter based: jumping to a history is a counter update, not a replay of the draws before it.
+# Each history owns 2^128 draws, far more than any random walk uses.
+# A typical history needs a few dozen variates of each kind, keep its pool blocks small.
+HISTORY_BLOCK_SIZE = 64
+
+SOBOL_DIRECTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sobol_directions.txt")
+# Sobol points are 32 bit binary fractions, enough for 2^32 histories per stream
+SOBOL_BITS = 32
+# Steps of every history that use Sobol points: the first flight and the first collisions
+QMC_STEPS = 4
+
+
+def get_history_rng(seed, history_index):
+    return VariatePool(np.random.Generator(np.random.Philox(key=seed).jumped(history_index)), HISTORY_BLOCK_SIZE)
+
+
+def get_history_rngs(seed, first_history, num_histories):
+    for history_index in range(first_history, first_history + num_histories):
+        yield get_history_rng(seed, history_index)
+
+
+def replay_history(simulate_function, seed, history_index, *args):
+    # Works with any per-history engine taking rng as its last argument, e.g.
+    # replay_history(simulate_simple_two_slab, seed, 123456, x, v, water_width)
+    return simulate_function(*args, rng=get_history_rng(seed, history_index))
+
+
+def mix64(z):
+    # SplitMix64 finalizer, wrapping uint64 arithmetic
+    with np.errstate(over="ignore"):
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+class CounterStream:
+    # Vectorised counter-based uniforms: the value drawn for (history, step, dimension) only depends on the seed and
+    # those three counters, not on which other histories are still alive. Two runs on different geometries with the
+    # same stream therefore use the same random numbers history by history (correlated sampling).
+    GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+    def __init__(self, seed, first_history=0):
+        self.key = mix64(np.array(seed, dtype=np.uint64))
+        self.first_history = first_history
+
+    def uniforms(self, histories, step, num_dimensions, particles=None):
+        # particles: optional ids of the neutrons split from a history (get_split_particles), 0 is the history itself
+        histories = np.asarray(histories, dtype=np.uint64) + np.uint64(self.first_history)
+        dimensions = np.arange(1, num_dimensions + 1, dtype=np.uint64)[:, None]
+        with np.errstate(over="ignore"):
+            history_keys = mix64(self.key ^ mix64(histories * self.GOLDEN_GAMMA))
+            if particles is not None and np.any(particles):
+                split = particles != 0
+                history_keys[split] = mix64(history_keys[split] ^ particles[split])
+            step_keys = mix64(history_keys + np.uint64(step + 1) * self.GOLDEN_GAMMA)
+            z = mix64(step_keys[None, :] ^ (dimensions * self.GOLDEN_GAMMA))
+        # 53 random bits, centred so the result is never exactly 0 or 1
+        return ((z >> np.uint64(11)).astype(float) + 0.5) * 2.0 ** -53
+
+
+def get_split_particles(particles, split_counts, step, stage=0):
+    # Ids of the copies of split neutrons. The first copy keeps the id of its neutron, the others get ids hashed from
+    # it, the step and their copy number, so every copy draws its own random numbers. stage tells apart the
+    # splittings of a single step.
+    parents = np.repeat(particles, split_counts)
+    copies = (np.arange(parents.size) - np.repeat(np.cumsum(split_counts) - split_counts, split_counts)) \
+        .astype(np.uint64)
+    with np.errstate(over="ignore"):
+        copy_particles = mix64(parents ^ mix64(np.uint64(step + 1) * CounterStream.GOLDEN_GAMMA + copies
+                                               + (np.uint64(stage) << np.uint64(32))))
+    return np.where(copies == 0, parents, copy_particles)
+
+
+@lru_cache
+def get_sobol_direction_numbers(file_name=SOBOL_DIRECTIONS_FILE):
+    # (dimensions, SOBOL_BITS) direction numbers, as integers scaled by 2^SOBOL_BITS. Dimension 0 is the van der
+    # Corput sequence, the others follow the file (d s a m_1..m_s per line, Joe and Kuo format).
+    bits = np.arange(1, SOBOL_BITS + 1)
+    direction_numbers = [1 << (SOBOL_BITS - bits)]
+    with open(file_name) as file:
+        for line in file:
+            if line.startswith("#") or not line.strip():
+                continue
+            _, degree, coefficients, *initial = map(int, line.split())
+            numbers = [m << (SOBOL_BITS - i) for i, m in enumerate(initial, start=1)]
+            for i in range(degree, SOBOL_BITS):
+                number = numbers[i - degree] ^ (numbers[i - degree] >> degree)
+                for k in range(1, degree):
+                    if (coefficients >> (degree - 1 - k)) & 1:
+                        number ^= numbers[i - k]
+                numbers.append(number)
+            direction_numbers.append(np.array(numbers))
+    return np.array(direction_numbers, dtype=np.uint64)
+
+
+def scramble_direction_numbers(direction_numbers, rng):
+    # Linear matrix scrambling: every dimension gets a random lower triangular binary matrix with unit diagonal, digit
+    # r of a scrambled number is the parity of row r and the digits of the number. Most significant digit first.
+    num_dimensions = direction_numbers.shape[0]
+    digits = np.arange(SOBOL_BITS)
+    lower = rng.integers(0, 2, (num_dimensions, SOBOL_BITS, SOBOL_BITS), dtype=np.uint64) \
+        * (digits[None, :, None] > digits[None, None, :])
+    lower[:, digits, digits] = 1
+    # Row r as a mask over the digits of a number, digit c being bit SOBOL_BITS - 1 - c
+    rows = np.sum(lower << (SOBOL_BITS - 1 - digits).astype(np.uint64), axis=2, dtype=np.uint64)
+    parities = np.bitwise_count(rows[:, :, None] & direction_numbers[:, None, :]) & 1
+    return np.sum(parities.astype(np.uint64) << (SOBOL_BITS - 1 - digits).astype(np.uint64)[None, :, None], axis=1,
+                  dtype=np.uint64)
+
+
+def get_sobol_points(direction_numbers, shifts, indices):
+    # (dimensions, points) coordinates of the Sobol points of the given indices, digitally shifted, in (0, 1)
+    indices = np.asarray(indices, dtype=np.uint64)
+    points = np.zeros((direction_numbers.shape[0], indices.size), dtype=np.uint64)
+    for bit in range(int(indices.max(initial=0)).bit_length()):
+        has_bit = ((indices >> np.uint64(bit)) & np.uint64(1)).astype(bool)
+        points[:, has_bit] ^= direction_numbers[:, bit, None]
+    return ((points ^ shifts[:, None]).astype(float) + 0.5) * 2.0 ** -SOBOL_BITS
+
+
+class SobolStream(CounterStream):
+    # Randomized quasi-Monte Carlo. In the first num_steps steps, history n takes its uniforms from Sobol point n,
+    # one Sobol dimension per (step, dimension), scrambled and shifted with its own seed. Later steps, dimensions past
+    # the direction numbers and split copies use the counter-based uniforms. The histories of a stream are not
+    # independent: the error of a tally comes from independent streams (HistogramTally.make_batch).
+
+    def __init__(self, seed, first_history=0, num_steps=QMC_STEPS):
+        super().__init__(seed, first_history)
+        self.num_steps = num_steps
+        rng = np.random.default_rng([int(seed), first_history])
+        self.direction_numbers = scramble_direction_numbers(get_sobol_direction_numbers(), rng)
+        self.shifts = rng.integers(0, 2 ** SOBOL_BITS, self.direction_numbers.shape[0], dtype=np.uint64)
+
+    def uniforms(self, histories, step, num_dimensions, particles=None):
+        uniforms = super().uniforms(histories, step, num_dimensions, particles)
+        first_dimension = step * num_dimensions
+        num_sobol_dimensions = min(num_dimensions, self.direction_numbers.shape[0] - first_dimension)
+        if step >= self.num_steps or num_sobol_dimensions <= 0:
+            return uniforms
+        dimensions = slice(first_dimension, first_dimension + num_sobol_dimensions)
+        sobol = np.flatnonzero(particles == 0) if particles is not None else np.arange(np.size(histories))
+        uniforms[:num_sobol_dimensions, sobol] = get_sobol_points(self.direction_numbers[dimensions],
+                                                                  self.shifts[dimensions],
+                                                                  np.asarray(histories)[sobol])
+        return uniforms
@@ -0,0 +1,123 @@
+import ast
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+
+import numpy as np
+
+PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DATA_DIRECTORY = os.path.join(PACKAGE_DIRECTORY, "data")
+# Results of long campaigns, stored on disk under a hash of everything they depend on: the function, its arguments
+# (geometry, num_buckets, ...) and the code version, the simulation source of every loaded module of the package and
+# the data files (cross sections, seeds and constants included). Plotting code is left out of the code version, a
+# figure can be changed without running the campaign again. The target of a campaign is not part of the key, see
+# load_or_top_up.
+CACHE_DIRECTORY = "cache"
+# Least recently used results are deleted once the cache is larger than this
+MAX_CACHE_SIZE = 2 * 1024 ** 3  # bytes
+
+
+def get_simulation_source(module):
+    # Source of the module without its plot_ functions and its __main__ block
+    tree = ast.parse(inspect.getsource(module))
+    tree.body = [node for node in tree.body
+                 if not (isinstance(node, ast.FunctionDef) and node.name.startswith("plot_"))
+                 and not (isinstance(node, ast.If) and "__main__" in ast.unparse(node.test))]
+    return ast.unparse(tree)
+
+
+def get_code_version():
+    code_hash = hashlib.sha256()
+    modules = [module for module in list(sys.modules.values())
+               if os.path.dirname(os.path.abspath(getattr(module, "__file__", None) or "/")) == PACKAGE_DIRECTORY]
+    for module in sorted(modules, key=lambda module: os.path.basename(module.__file__)):
+        code_hash.update(os.path.basename(module.__file__).encode())
+        code_hash.update(get_simulation_source(module).encode())
+    for file_name in sorted(os.listdir(DATA_DIRECTORY)):
+        with open(os.path.join(DATA_DIRECTORY, file_name), "rb") as file:
+            code_hash.update(file_name.encode())
+            code_hash.update(file.read())
+    return code_hash.hexdigest()
+
+
+def get_canonical_form(value):
+    # Text that only depends on the value: functions by name, arrays by content, dicts sorted
+    if isinstance(value, functools.partial):
+        return f"partial({get_canonical_form(value.func)}, {get_canonical_form(value.args)}, " \
+               f"{get_canonical_form(value.keywords)})"
+    if callable(value) and hasattr(value, "__qualname__"):
+        module_name = value.__module__
+        if module_name == "__main__":
+            # The driver run as a script, named after its file
+            module_name = os.path.splitext(os.path.basename(getattr(sys.modules[module_name], "__file__",
+                                                                    module_name)))[0]
+        return f"{module_name}.{value.__qualname__}"
+    if isinstance(value, np.ndarray):
+        return f"array({value.dtype}, {value.shape}, {hashlib.sha256(np.ascontiguousarray(value)).hexdigest()})"
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{key!r}: {get_canonical_form(value[key])}" for key in sorted(value)) + "}"
+    if isinstance(value, (list, tuple)):
+        items = ", ".join(get_canonical_form(item) for item in value)
+        return f"{type(value).__name__}({items})"
+    return repr(value)
+
+
+def get_cache_key(function, args, kwargs):
+    key = get_canonical_form((function, args, kwargs)) + get_code_version()
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def evict(cache_directory=CACHE_DIRECTORY, max_size=MAX_CACHE_SIZE):
+    # Oldest modification time first, loading a result touches it
+    paths = [os.path.join(cache_directory, file_name) for file_name in os.listdir(cache_directory)
+             if file_name.endswith(".pkl")]
+    paths.sort(key=os.path.getmtime)
+    total_size = sum(os.path.getsize(path) for path in paths)
+    for path in paths:
+        if total_size <= max_size:
+            break
+        total_size -= os.path.getsize(path)
+        os.remove(path)
+
+
+def store(path, result, cache_directory, max_size):
+    # Written under a temporary name first, an interrupted run never leaves a truncated result behind
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, path)
+    evict(cache_directory, max_size)
+
+
+def load_or_top_up(function, *args, target, cache_directory=CACHE_DIRECTORY, max_size=MAX_CACHE_SIZE, **kwargs):
+    # For campaigns that can be continued, e.g. campaign.run_adaptive_campaign: function(*args, target=target,
+    # previous=result, checkpoint=checkpoint, previous_elapsed_time=elapsed_time, **kwargs) adds histories to result,
+    # an earlier result of the same campaign, until target is met. The result is stored without its target, a run with
+    # a stricter target only runs the extra histories on the streams that follow the stored ones. A result that
+    # already ran to the same target is loaded as is.
+    # The checkpoints of the running campaign are stored in its place, without a target and with their elapsed time:
+    # a run that was killed resumes from its last checkpoint, with its time budget going on from there.
+    os.makedirs(cache_directory, exist_ok=True)
+    path = os.path.join(cache_directory, f"{get_cache_key(function, args, kwargs)}.pkl")
+    previous, previous_elapsed_time = None, None
+    if os.path.exists(path):
+        with open(path, "rb") as file:
+            previous, previous_target, previous_elapsed_time = pickle.load(file)
+        os.utime(path)
+        if previous_target == target:
+            print(f"Loaded {function.__name__} from {path}")
+            return previous
+        if previous_target is None:
+            print(f"Resuming {function.__name__} from the checkpoint {path}")
+
+    def checkpoint(tallies, num_simulations, elapsed_time):
+        store(path, ((tallies, num_simulations), None, elapsed_time), cache_directory, max_size)
+
+    result = function(*args, target=target, previous=previous, checkpoint=checkpoint,
+                      previous_elapsed_time=previous_elapsed_time, **kwargs)
+    # A finished campaign is topped up on a fresh clock
+    store(path, (result, target, None), cache_directory, max_size)
+    return result
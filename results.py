@@ -1,119 +1,147 @@
-import math
 import os
-from collections import defaultdict
+from functools import partial
 
 import matplotlib.pyplot as plt
 import numpy as np
 
-from simulation import simulate_simple, simulate_single_collision, simulate_multiple_collision
+from campaign import CampaignTarget, run_adaptive_campaign
+from geometry import CrossSections, Layer, SlabGeometry
+from result_cache import load_or_top_up
+from simulation import ABSORBANCE_PERCENTAGE, MACROSCOPIC_CROSS_SECTION, simulate_collision_events_batch, \
+    SLAB_THICKNESS
 from simulation_two_slab import MACROSCOPIC_CS_SCATTERING_WATER
+from tallies import ExpectedValueTally, HistogramTally, print_relative_error
+from variance_reduction import DEFAULT_WEIGHT_WINDOW
 
 MACROSCOPIC_CS_ABSORBANCE = 0.010063
 
+INITIAL_POSITION = np.array([0, 0, 0])
+INITIAL_VELOCITY = np.array([1, 0, 0])
+# Material ID of the water, the geometry uses VOID (0) around it
+WATER = 1
+# The homogeneous water slab of simulation.py
+WATER_SLAB = SlabGeometry([Layer(WATER, SLAB_THICKNESS, CrossSections(
+    MACROSCOPIC_CROSS_SECTION, MACROSCOPIC_CROSS_SECTION * (1 - ABSORBANCE_PERCENTAGE),
+    MACROSCOPIC_CROSS_SECTION * ABSORBANCE_PERCENTAGE))])
 
-def plot_flux_over_position(num_simulations, num_buckets):
-    bucket_width = 30 / num_buckets  # cm
-    bucket_counts = defaultdict(int)
-    initial_neutron_flux = 1000  # n/cm^2 s
 
-    initial_position = np.array([0, 0, 0])
-    initial_velocity = np.array([1, 0, 0])
+# The tallies score the weights of the collision events, 1 for analog histories. With a weight window every
+# collision scores its absorbed weight, instead of a few collisions scoring a whole absorption.
+def score_collision_events(num_simulations, events, selected, weights, num_buckets):
+    selected = selected & (weights > 0)
+    return HistogramTally(num_buckets).score(num_simulations, events.positions[selected, 0],
+                                             events.histories[selected], weights[selected])
 
-    for i in range(num_simulations):
-        result, final_position = simulate_simple(initial_position, initial_velocity)
-        if result != "ABSORBED":
-            continue
 
-        final_x = final_position[0]
+def tally_absorption_sites(num_simulations, rng, num_buckets, weight_window=None):
+    events = simulate_collision_events_batch(INITIAL_POSITION, INITIAL_VELOCITY, num_simulations, rng, weight_window)
+    return score_collision_events(num_simulations, events, np.ones(events.numbers.size, dtype=bool),
+                                  events.absorbed_weights, num_buckets)
 
-        bucket_number = math.floor(final_x / bucket_width)
-        bucket_counts[bucket_number] += 1
 
-    def transform(count):
-        return count * initial_neutron_flux / (
-                num_simulations * bucket_width * MACROSCOPIC_CS_ABSORBANCE)
+def tally_single_collision_sites(num_simulations, rng, num_buckets, weight_window=None):
+    events = simulate_collision_events_batch(INITIAL_POSITION, INITIAL_VELOCITY, num_simulations, rng, weight_window,
+                                             max_collisions=1)
+    return score_collision_events(num_simulations, events, events.numbers == 0,
+                                  events.weights - events.absorbed_weights, num_buckets)
 
-    flux_dict = {(bucket * bucket_width + bucket_width / 2): transform(count) for bucket, count
-                 in
-                 bucket_counts.items()}
-    flux = np.array(list(flux_dict.values()))
-    positions = np.array(list(flux_dict.keys()))
 
-    plt.bar(positions, flux, color='skyblue', edgecolor='black', width=bucket_width)
-    plt.xlabel('Distance (cm)')
-    plt.ylabel('Flux ($cm^{-2}s^{-1}$)')
-    plt.title('Flux over position for an initial flux of 1000$cm^{-2}s^{-1}$')
-    file_name = f"total_flux_{num_simulations}_num_buckets{num_buckets}"
-    plt.savefig(f"figures/task1/{file_name}.png", dpi=300, bbox_inches='tight')
-    plt.clf()
+def tally_expected_single_collision_flux(num_buckets):
+    # Expected value of the single collision sites over the scattering cross section. Every source neutron flies the
+    # same ray through the water, a single history gives the exact tally.
+    direction_x = INITIAL_VELOCITY[0] / np.linalg.norm(INITIAL_VELOCITY)
+    return ExpectedValueTally(num_buckets).score(1, WATER_SLAB, np.array([float(INITIAL_POSITION[0])]),
+                                                 np.array([direction_x]), WATER_SLAB.total_cross_sections[None])
 
 
-def plot_single_collision_flux(num_simulations, num_buckets):
-    bucket_width = 30 / num_buckets  # cm
-    bucket_counts = defaultdict(int)
-    initial_neutron_flux = 1000  # n/cm^2 s
+def tally_multiple_collision_absorption_sites(num_simulations, rng, num_buckets, weight_window=None):
+    events = simulate_collision_events_batch(INITIAL_POSITION, INITIAL_VELOCITY, num_simulations, rng, weight_window)
+    return score_collision_events(num_simulations, events, events.numbers != 0, events.absorbed_weights,
+                                  num_buckets)
 
-    initial_position = np.array([0, 0, 0])
-    initial_velocity = np.array([1, 0, 0])
 
-    for i in range(num_simulations):
-        result, final_position = simulate_single_collision(initial_position, initial_velocity)
-        if result != "OTHER":
-            continue
+def tally_thermalization_sites(num_simulations, rng, num_buckets, weight_window=None):
+    events = simulate_collision_events_batch(INITIAL_POSITION, INITIAL_VELOCITY, num_simulations, rng, weight_window)
+    return score_collision_events(num_simulations, events, events.thermalized,
+                                  events.weights - events.absorbed_weights, num_buckets)
 
-        final_x = final_position[0]
 
-        bucket_number = math.floor(final_x / bucket_width)
-        bucket_counts[bucket_number] += 1
+def plot_flux_over_position(target, num_buckets, weight_window=None):
+    bucket_width = 30 / num_buckets  # cm
+    initial_neutron_flux = 1000  # n/cm^2 s
 
-    def transform(count):
-        return count * initial_neutron_flux / (
-                num_simulations * bucket_width * MACROSCOPIC_CS_SCATTERING_WATER)
+    tally, num_simulations = load_or_top_up(run_adaptive_campaign, partial(tally_absorption_sites,
+                                                                           num_buckets=num_buckets,
+                                                                           weight_window=weight_window), target=target)
+    flux = tally.normalize(MACROSCOPIC_CS_ABSORBANCE, initial_neutron_flux)
+    scored = tally.sums > 0
+    print_relative_error(tally, "Total flux")
 
-    flux_dict = {(bucket * bucket_width + (bucket_width / 2)): transform(count) for bucket, count
-                 in
-                 bucket_counts.items()}
-    flux = np.array(list(flux_dict.values()))
-    positions = np.array(list(flux_dict.keys()))
+    positions = tally.get_bucket_centers()[scored]
+    flux_error = (flux * tally.get_relative_error())[scored]
+    flux = flux[scored]
 
-    plt.bar(positions, flux, color='skyblue', edgecolor='skyblue', width=bucket_width)
+    plt.bar(positions, flux, color='skyblue', edgecolor='black', width=bucket_width, yerr=flux_error)
     plt.xlabel('Distance (cm)')
     plt.ylabel('Flux ($cm^{-2}s^{-1}$)')
-    plt.title('Singe interaction flux over position for an initial flux of 1000$cm^{-2}s^{-1}$')
-    file_name = f"single_collision_flux_{num_simulations}_num_buckets{num_buckets}"
+    plt.title('Flux over position for an initial flux of 1000$cm^{-2}s^{-1}$')
+    file_name = f"total_flux_{num_simulations}_num_buckets{num_buckets}"
     plt.savefig(f"figures/task1/{file_name}.png", dpi=300, bbox_inches='tight')
     plt.clf()
 
 
-def plot_multiple_collision_flux_over_position(num_simulations, num_buckets):
+def plot_single_collision_flux(target, num_buckets, weight_window=None, estimator="COLLISION"):
+    # estimator="EXPECTED_VALUE" scores the expected value of every source neutron instead of its collision site
     bucket_width = 30 / num_buckets  # cm
-    bucket_counts = defaultdict(int)
     initial_neutron_flux = 1000  # n/cm^2 s
 
-    initial_position = np.array([0, 0, 0])
-    initial_velocity = np.array([1, 0, 0])
-
-    for i in range(num_simulations):
-        result, final_position, collisions = simulate_multiple_collision(initial_position, initial_velocity)
-        if result != "ABSORBED" or collisions == 1:
-            continue
+    if estimator == "COLLISION":
+        tally, num_simulations = load_or_top_up(run_adaptive_campaign,
+                                                partial(tally_single_collision_sites, num_buckets=num_buckets,
+                                                        weight_window=weight_window), target=target)
+        flux = tally.normalize(MACROSCOPIC_CS_SCATTERING_WATER, initial_neutron_flux)
+        relative_error = tally.get_relative_error()
+        print_relative_error(tally, "Single collision flux")
+        file_name = f"single_collision_flux_{num_simulations}_num_buckets{num_buckets}"
+    elif estimator == "EXPECTED_VALUE":
+        # Exact, no campaign and no statistical error
+        tally = tally_expected_single_collision_flux(num_buckets)
+        flux = tally.normalize(source_intensity=initial_neutron_flux)
+        relative_error = np.zeros(num_buckets)
+        file_name = f"single_collision_flux_expected_value_num_buckets{num_buckets}"
+    else:
+        raise ValueError(f"Unknown single collision estimator {estimator}")
+    scored = tally.sums > 0
+
+    positions = tally.get_bucket_centers()[scored]
+    flux_error = (flux * relative_error)[scored]
+    flux = flux[scored]
+
+    plt.bar(positions, flux, color='skyblue', edgecolor='skyblue', width=bucket_width, yerr=flux_error)
+    plt.xlabel('Distance (cm)')
+    plt.ylabel('Flux ($cm^{-2}s^{-1}$)')
+    plt.title('Singe interaction flux over position for an initial flux of 1000$cm^{-2}s^{-1}$')
+    plt.savefig(f"figures/task1/{file_name}.png", dpi=300, bbox_inches='tight')
+    plt.clf()
 
-        final_x = final_position[0]
 
-        bucket_number = math.floor(final_x / bucket_width)
-        bucket_counts[bucket_number] += 1
+def plot_multiple_collision_flux_over_position(target, num_buckets, weight_window=None):
+    bucket_width = 30 / num_buckets  # cm
+    initial_neutron_flux = 1000  # n/cm^2 s
 
-    def transform(count):
-        return count * initial_neutron_flux / (
-                num_simulations * bucket_width * MACROSCOPIC_CS_ABSORBANCE)
+    tally, num_simulations = load_or_top_up(
+        run_adaptive_campaign,
+        partial(tally_multiple_collision_absorption_sites, num_buckets=num_buckets, weight_window=weight_window),
+        target=target)
+    flux = tally.normalize(MACROSCOPIC_CS_ABSORBANCE, initial_neutron_flux)
+    scored = tally.sums > 0
+    print_relative_error(tally, "Multiple collision flux")
 
-    flux_dict = {(bucket * bucket_width + (bucket_width / 2)): transform(count) for bucket, count
-                 in
-                 bucket_counts.items()}
-    flux = np.array(list(flux_dict.values()))
-    positions = np.array(list(flux_dict.keys()))
+    positions = tally.get_bucket_centers()[scored]
+    flux_error = (flux * tally.get_relative_error())[scored]
+    flux = flux[scored]
 
-    plt.bar(positions, flux, color='skyblue', edgecolor='black', width=bucket_width)
+    plt.bar(positions, flux, color='skyblue', edgecolor='black', width=bucket_width, yerr=flux_error)
     plt.xlabel('Distance (cm)')
     plt.ylabel('Flux ($cm^{-2}s^{-1}$)')
     plt.title('Multiple interactions flux over position for an initial flux of 1000$cm^{-2}s^{-1}$')
@@ -122,34 +150,22 @@ def plot_multiple_collision_flux_over_position(num_simulations, num_buckets):
     plt.clf()
 
 
-def plot_slowing_down_density(num_simulations, num_buckets):
+def plot_slowing_down_density(target, num_buckets, weight_window=None):
     bucket_width = 30 / num_buckets  # cm
-    bucket_counts = defaultdict(int)
     initial_neutron_flux = 1000  # n/cm^2 s
 
-    initial_position = np.array([0, 0, 0])
-    initial_velocity = np.array([1, 0, 0])
-
-    for i in range(num_simulations):
-        result, final_position = simulate_simple(initial_position, initial_velocity)
-        if result != "THERMALIZED":
-            continue
-
-        final_x = final_position[0]
-
-        bucket_number = math.floor(final_x / bucket_width)
-        bucket_counts[bucket_number] += 1
+    tally, num_simulations = load_or_top_up(run_adaptive_campaign, partial(tally_thermalization_sites,
+                                                                           num_buckets=num_buckets,
+                                                                           weight_window=weight_window), target=target)
+    flux = tally.normalize(source_intensity=initial_neutron_flux)
+    scored = tally.sums > 0
+    print_relative_error(tally, "Slowing down density")
 
-    def transform(count):
-        return count * initial_neutron_flux / (num_simulations * bucket_width)
+    positions = tally.get_bucket_centers()[scored]
+    flux_error = (flux * tally.get_relative_error())[scored]
+    flux = flux[scored]
 
-    flux_dict = {(bucket * bucket_width + (bucket_width / 2)): transform(count) for bucket, count in
-                 bucket_counts.items()}
-
-    flux = np.array(list(flux_dict.values()))
-    positions = np.array(list(flux_dict.keys()))
-
-    plt.bar(positions, flux, color='skyblue', edgecolor='black', width=bucket_width)
+    plt.bar(positions, flux, color='skyblue', edgecolor='black', width=bucket_width, yerr=flux_error)
     plt.xlabel('Distance (cm)')
     plt.ylabel('Slowing down density ($cm^{-3}s^{-1}$)')
     plt.title('Slowing down density over position for an initial flux of 1000$cm^{-2}s^{-1}$')
@@ -158,11 +174,17 @@ def plot_slowing_down_density(num_simulations, num_buckets):
     plt.clf()
 
 
-os.makedirs("figures", exist_ok=True)
-os.makedirs("figures/task1", exist_ok=True)
-
-scale_num_simulation = 1000  # 100 for standard, 1000 for good results, 1 for quick test
-plot_flux_over_position(num_simulations=200 * scale_num_simulation, num_buckets=100)
-plot_single_collision_flux(num_simulations=5000 * scale_num_simulation, num_buckets=600)
-plot_multiple_collision_flux_over_position(num_simulations=200 * scale_num_simulation, num_buckets=100)
-plot_slowing_down_density(num_simulations=200 * scale_num_simulation, num_buckets=60)
+if __name__ == "__main__":
+    os.makedirs("figures", exist_ok=True)
+    os.makedirs("figures/task1", exist_ok=True)
+
+    # Every figure runs until its worst scored bin is at 2% relative error, or for at most 10 minutes.
+    # CampaignTarget(time_budget=10) for a quick test.
+    target = CampaignTarget(relative_error=0.02, time_budget=600)
+    # Campaigns that already ran with the same code and parameters come from the result cache, a stricter target
+    # only adds the missing histories to them
+    # The absorption based flux figures score every collision with survival biasing, weight_window=None for analog
+    plot_flux_over_position(target, num_buckets=100, weight_window=DEFAULT_WEIGHT_WINDOW)
+    plot_single_collision_flux(target, num_buckets=600, estimator="EXPECTED_VALUE")
+    plot_multiple_collision_flux_over_position(target, num_buckets=100, weight_window=DEFAULT_WEIGHT_WINDOW)
+    plot_slowing_down_density(target, num_buckets=60)
@@ -1,52 +1,86 @@
 import math
-from collections import defaultdict
+from collections import Counter
+from functools import partial
 
 import matplotlib.pyplot as plt
 import numpy as np
 
+from campaign import run_campaign
+from lethargy_solver import get_collision_number_moments, solve_slowing_down
 from simulation import simulate_simple, simulate_single_collision, simulate_multiple_collision
-from simulation_homogenous_media import simulate_homogenous_without_absorbance, simulate_water_simple_with_absorbance
+from simulation_homogenous_media import slow_down_batch
 
 MACROSCOPIC_CS_ABSORBANCE = 0.010063
+# Histories per chunk of the lethargy engine
+CHUNK_SIZE = 10 ** 6
+
+
+def count_collisions(num_simulations, rng, media, with_absorbance=False, weight_window=None):
+    # Distribution of the number of collisions to thermalize, absorbed neutrons are left out. Every neutron counts
+    # for its weight, 1 for analog histories.
+    results, num_collisions, weights = slow_down_batch(num_simulations, media, rng, with_absorbance, weight_window)
+    thermalized = results == "THERMALIZED"
+    collision_weights = np.bincount(num_collisions[thermalized], weights[thermalized])
+    return Counter({collisions: weight for collisions, weight in enumerate(collision_weights.tolist()) if weight > 0})
+
+
+def print_collision_distribution(collisions_count, label):
+    collisions = np.array(sorted(collisions_count))
+    counts = np.array([collisions_count[collision] for collision in collisions])
+    total_simulations = counts.sum()
+
+    average_collisions = np.sum(collisions * counts) / total_simulations if total_simulations > 0 else 0
+    standard_deviation = math.sqrt(np.sum((collisions - average_collisions) ** 2 * counts) / total_simulations) \
+        if total_simulations > 0 else 0
+
+    print(f"Average number of collisions in {label}: {average_collisions} (standard deviation "
+          f"{standard_deviation:.3f}, {total_simulations:.0f} thermalized neutrons)")
+    if total_simulations > 0:
+        percentiles = collisions[np.searchsorted(np.cumsum(counts), np.array([0.01, 0.5, 0.99]) * total_simulations)]
+        print(f"Collisions min {collisions[0]}, 1% {percentiles[0]}, median {percentiles[1]}, "
+              f"99% {percentiles[2]}, max {collisions[-1]}")
+
+
+def print_reference_comparison(collisions_count, num_simulations, media, with_absorbance=False):
+    # Checks a Monte Carlo run against the deterministic solution of lethargy_solver, differences are given in
+    # standard errors of the Monte Carlo estimate. The errors are those of an analog run, survival biasing makes the
+    # real ones smaller.
+    solution = solve_slowing_down(media, with_absorbance)
+    reference_mean, reference_deviation = get_collision_number_moments(solution)
+    num_thermalized = sum(collisions_count.values())
+    average_collisions = sum(key * value for key, value in collisions_count.items()) / num_thermalized
+    mean_difference = (average_collisions - reference_mean) / (reference_deviation / math.sqrt(num_thermalized))
+    print(f"Reference average number of collisions {reference_mean:.4f}, Monte Carlo off by {mean_difference:.2f} "
+          f"standard errors")
+
+    if with_absorbance:
+        thermalization_probability = num_thermalized / num_simulations
+        probability_error = math.sqrt(solution.thermalization_probability * (1 - solution.thermalization_probability)
+                                      / num_simulations)
+        probability_difference = (thermalization_probability - solution.thermalization_probability) \
+            / probability_error
+        print(f"Reference thermalization probability {solution.thermalization_probability:.5f}, Monte Carlo "
+              f"{thermalization_probability:.5f}, off by {probability_difference:.2f} standard errors")
 
 
 def print_average_collision_number(num_simulations, media):
-    collisions_count = defaultdict(int)
-
-    initial_velocity = np.array([1, 0, 0])
-
-    for i in range(num_simulations):
-        collisions = simulate_homogenous_without_absorbance(initial_velocity, media)
-
-        collisions_count[collisions] += 1
-
-    total_collisions = sum(key * value for key, value in collisions_count.items())
-    total_simulations = sum(collisions_count.values())
-
-    average_collisions = total_collisions / total_simulations if total_simulations > 0 else 0
-
-    print(f"Average number of collisions in {media}: {average_collisions}")
-
-
-def print_average_collision_number_with_absorbance(num_simulations):
-    collisions_count = defaultdict(int)
-
-    initial_velocity = np.array([1, 0, 0])
-
-    for i in range(num_simulations):
-        result, collisions = simulate_water_simple_with_absorbance(initial_velocity)
-        if result == "THERMALIZED":
-            collisions_count[collisions] += 1
-
-    total_collisions = sum(key * value for key, value in collisions_count.items())
-    total_simulations = sum(collisions_count.values())
-
-    average_collisions = total_collisions / total_simulations if total_simulations > 0 else 0
-
-    print(f"Average number of collisions in water with absorbance: {average_collisions}")
-
-simulation_number=100000
-print_average_collision_number(simulation_number,"HYDROGEN")
-print_average_collision_number(simulation_number,"OXYGEN")
-print_average_collision_number(simulation_number,"WATER")
-print_average_collision_number_with_absorbance(simulation_number)
+    # Returns the collision count distribution, a Counter {number of collisions: number of neutrons}
+    collisions_count = run_campaign(partial(count_collisions, media=media), num_simulations, chunk_size=CHUNK_SIZE)
+    print_collision_distribution(collisions_count, media)
+    print_reference_comparison(collisions_count, num_simulations, media)
+    return collisions_count
+
+
+def print_average_collision_number_with_absorbance(num_simulations, weight_window=None):
+    collisions_count = run_campaign(partial(count_collisions, media="WATER", with_absorbance=True,
+                                            weight_window=weight_window), num_simulations, chunk_size=CHUNK_SIZE)
+    print_collision_distribution(collisions_count, "water with absorbance")
+    print_reference_comparison(collisions_count, num_simulations, "WATER", with_absorbance=True)
+    return collisions_count
+
+if __name__ == "__main__":
+    simulation_number = 10 ** 7
+    print_average_collision_number(simulation_number,"HYDROGEN")
+    print_average_collision_number(simulation_number,"OXYGEN")
+    print_average_collision_number(simulation_number,"WATER")
+    print_average_collision_number_with_absorbance(simulation_number)
@@ -1,172 +1,186 @@
-import math
 import os
 import time
-from collections import defaultdict
+from functools import partial
 
 import matplotlib.pyplot as plt
 import numpy as np
 
-from simulation_two_slab import simulate_simple_two_slab, get_media, \
-    simulate_single_collision_two_slab, simulate_multiple_collision_two_slab, \
-    get_macroscopic_cross_section_scattering, simulate_slow_down_density_two_slab, get_macroscopic_cross_section
+from campaign import CampaignTarget, CHUNK_SIZE, get_sweep_results, QMC_CHUNK_SIZE, run_adaptive_sweep_totals
+from result_cache import load_or_top_up
+from simulation_two_slab import transport_two_slab_batch
+from tallies import ExpectedValueTally, print_relative_error, score_tallies, select_collision_flux, \
+    select_first_scattering_flux, select_multiple_collision_flux, select_source_neutrons, select_thermalization_sites, \
+    select_tracks, TrackLengthTally
 
 start_time = time.time()
 
+INITIAL_POSITION = np.array([0, 0, 0])
+INITIAL_VELOCITY = np.array([1, 0, 0])
+WATER_WIDTHS = (5, 10, 15, 30)
+# Water, then the carbon in 2 layers, for geometry splitting. (1, 4, 8, 16, 32) gets the carbon side tallies to the
+# same error with about 15 times fewer histories, but the sweep then waits on the 30cm width, which has no carbon,
+# and the extra copies cost more time than they save.
+IMPORTANCES = (1.0, 2.0, 4.0)
+# Tallies of run_all_tallies, in order
+TALLY_NAMES = ("TOTAL_FLUX", "SINGLE_COLLISION_FLUX", "MULTIPLE_COLLISION_FLUX", "SLOWING_DOWN_DENSITY")
+
+
+def tally_histories(num_simulations, rng, water_width, tallies, tracking="SURFACE", cross_sections="CONSTANT",
+                    weight_window=None, importances=None):
+    events = transport_two_slab_batch(INITIAL_POSITION, INITIAL_VELOCITY, num_simulations, water_width, rng,
+                                      tracking=tracking, cross_sections=cross_sections, weight_window=weight_window,
+                                      importances=importances)
+    return score_tallies(events, tallies)
+
+
+def get_flux_tally(flux_estimator, num_buckets):
+    if flux_estimator == "COLLISION":
+        return select_collision_flux, num_buckets
+    elif flux_estimator == "TRACK_LENGTH":
+        return select_tracks, num_buckets, TrackLengthTally
+    raise ValueError(f"Unknown flux estimator {flux_estimator}")
+
+
+def get_single_collision_tally(single_collision_estimator, num_buckets):
+    if single_collision_estimator == "COLLISION":
+        return select_first_scattering_flux, num_buckets
+    elif single_collision_estimator == "EXPECTED_VALUE":
+        return select_source_neutrons, num_buckets, ExpectedValueTally
+    raise ValueError(f"Unknown single collision estimator {single_collision_estimator}")
+
+
+def get_chunk_size(sampling):
+    return QMC_CHUNK_SIZE if sampling == "QMC" else CHUNK_SIZE
+
+
+def run_all_tallies(target, num_buckets, num_buckets_single_collision, flux_estimator="COLLISION",
+                    single_collision_estimator="COLLISION", tracking="SURFACE", cross_sections="CONSTANT",
+                    weight_window=None, importances=None, sampling="PSEUDO", previous=None,
+                    checkpoint=None, previous_elapsed_time=None):
+    # One set of histories feeds the four figures: total flux, single collision flux, multiple collision flux and
+    # slowing down density. The water widths are swept with correlated sampling, every width replays the same random
+    # numbers, so the differences between widths are much less noisy than independent runs.
+    # The total flux is scored with the collision estimator or the track-length estimator ("TRACK_LENGTH"), the
+    # single collision flux with the first scattering sites or their expected value along the source ray
+    # ("EXPECTED_VALUE").
+    # cross_sections="ENERGY" runs with the tabulated energy dependent cross sections of the data directory.
+    # weight_window (e.g. variance_reduction.DEFAULT_WEIGHT_WINDOW) turns on survival biasing and Russian roulette,
+    # importances (e.g. IMPORTANCES) geometry splitting in the carbon. sampling="QMC" draws the first flights and
+    # collisions from scrambled Sobol points, the errors then come from the spread between chunks.
+    # Returns the sweep totals and the number of histories, see get_all_tallies. previous: an earlier result with the
+    # same arguments, topped up with new histories until target is met. checkpoint and
+    # previous_elapsed_time: see campaign.run_adaptive_chunks.
+    tallies = [get_flux_tally(flux_estimator, num_buckets),
+               get_single_collision_tally(single_collision_estimator, num_buckets_single_collision),
+               (select_multiple_collision_flux, num_buckets),
+               (select_thermalization_sites, num_buckets)]
+    configurations = [{"water_width": water_width} for water_width in WATER_WIDTHS]
+    sweep_totals, num_simulations = run_adaptive_sweep_totals(
+        partial(tally_histories, tallies=tallies, tracking=tracking, cross_sections=cross_sections,
+                weight_window=weight_window, importances=importances), configurations, target,
+        chunk_size=get_chunk_size(sampling), sampling=sampling, previous=previous,
+        checkpoint=checkpoint, previous_elapsed_time=previous_elapsed_time)
+    print("Simulation done")
+    print(f"{time.time() - start_time:.2f}")
+    return sweep_totals, num_simulations
 
-def plot_flux_over_position(num_simulations, num_buckets, water_width, color):
-    bucket_width = 30 / num_buckets  # cm
-    bucket_counts = defaultdict(int)
-    initial_neutron_flux = 1000  # n/cm^2 s
-
-    initial_position = np.array([0, 0, 0])
-    initial_velocity = np.array([1, 0, 0])
-
-    for i in range(num_simulations):
-        result, all_interactions = simulate_simple_two_slab(initial_position, initial_velocity, water_width)
 
-        for interaction in all_interactions:
-            bucket_number = math.floor(interaction / bucket_width)
-            bucket_counts[bucket_number] += 1
+def get_all_tallies(sweep_totals, num_simulations, sampling="PSEUDO"):
+    sweep_tallies, sweep_differences, sweep_difference_errors, num_simulations = get_sweep_results(
+        sweep_totals, num_simulations, get_chunk_size(sampling))
+    all_tallies = {water_width: dict(zip(TALLY_NAMES, width_tallies))
+                   for water_width, width_tallies in zip(WATER_WIDTHS, sweep_tallies)}
+    # Difference of every width to the first one, with its standard error
+    all_differences = {water_width: (dict(zip(TALLY_NAMES, differences)), dict(zip(TALLY_NAMES, difference_errors)))
+                       for water_width, differences, difference_errors
+                       in zip(WATER_WIDTHS[1:], sweep_differences, sweep_difference_errors)}
+    return all_tallies, all_differences, num_simulations
 
-    def transform(position, count):
-        cs_absorbance = get_macroscopic_cross_section(
-            get_media([position + (bucket_width / 2), 0, 0], water_width))
-        return count * initial_neutron_flux / (
-                num_simulations * bucket_width * cs_absorbance)
 
-    flux_dict = {(bucket * bucket_width + bucket_width / 2): transform(bucket * bucket_width, count) for bucket, count
-                 in
-                 bucket_counts.items()}
-    flux_dict = {key: value for key, value in sorted(flux_dict.items())}
+def plot_flux_over_position(tally, water_width, color):
+    initial_neutron_flux = 1000  # n/cm^2 s
 
-    flux = np.array(list(flux_dict.values()))
-    positions = np.array(list(flux_dict.keys()))
+    positions = tally.get_bucket_centers()
+    flux = tally.normalize(source_intensity=initial_neutron_flux)
+    flux_error = flux * tally.get_relative_error()
+    scored = tally.sums > 0
+    print_relative_error(tally, f"Total flux, water {water_width}cm")
 
-    plt.plot(positions, flux, color=color, linestyle='-', linewidth=2, label=f"Water {water_width}cm")
+    plt.plot(positions[scored], flux[scored], color=color, linestyle='-', linewidth=2, label=f"Water {water_width}cm")
+    plt.fill_between(positions[scored], (flux - flux_error)[scored], (flux + flux_error)[scored], color=color,
+                     alpha=0.3)
     plt.xlabel('Distance (cm)')
     plt.ylabel('Flux ($cm^{-2}s^{-1}$)')
     plt.title('Flux over position for an initial flux of 1000$cm^{-2}s^{-1}$')
     plt.axvline(x=water_width, color=color, linestyle='--', linewidth=0.5)
-    print("Simulation done")
-    print(f"{time.time() - start_time:.2f}")
 
 
-def plot_flux_over_position_times_4(num_simulations_1, num_buckets_1):
-    plot_flux_over_position(num_simulations=num_simulations_1, num_buckets=num_buckets_1, water_width=5, color='brown')
-    plot_flux_over_position(num_simulations=num_simulations_1, num_buckets=num_buckets_1, water_width=10,
-                            color='olive')
-    plot_flux_over_position(num_simulations=num_simulations_1, num_buckets=num_buckets_1, water_width=15,
-                            color='limegreen')
-    plot_flux_over_position(num_simulations=num_simulations_1, num_buckets=num_buckets_1, water_width=30,
-                            color='skyblue')
+def plot_flux_over_position_times_4(all_tallies, num_simulations, num_buckets):
+    plot_flux_over_position(all_tallies[5]["TOTAL_FLUX"], water_width=5, color='brown')
+    plot_flux_over_position(all_tallies[10]["TOTAL_FLUX"], water_width=10, color='olive')
+    plot_flux_over_position(all_tallies[15]["TOTAL_FLUX"], water_width=15, color='limegreen')
+    plot_flux_over_position(all_tallies[30]["TOTAL_FLUX"], water_width=30, color='skyblue')
     plt.legend()
-    file_name = f"total_flux_{num_simulations_1}_num_buckets{num_buckets_1}"
+    file_name = f"total_flux_{num_simulations}_num_buckets{num_buckets}"
     plt.savefig(f"figures/{file_name}.png", dpi=300, bbox_inches='tight')
     plt.clf()
 
 
-def plot_single_collision_flux(num_simulations, num_buckets, water_width, color):
-    bucket_width = 30 / num_buckets  # cm
-    bucket_counts = defaultdict(int)
+def plot_single_collision_flux(tally, water_width, color):
     initial_neutron_flux = 1000  # n/cm^2 s
 
-    initial_position = np.array([0, 0, 0])
-    initial_velocity = np.array([1, 0, 0])
-
-    for i in range(num_simulations):
-        result, final_position = simulate_single_collision_two_slab(initial_position, initial_velocity, water_width)
-        if result != "OTHER":
-            continue
-
-        final_x = final_position[0]
+    positions = tally.get_bucket_centers()
+    flux = tally.normalize(source_intensity=initial_neutron_flux)
+    flux_error = flux * tally.get_relative_error()
+    scored = tally.sums > 0
+    print_relative_error(tally, f"Single collision flux, water {water_width}cm")
 
-        bucket_number = math.floor(final_x / bucket_width)
-        bucket_counts[bucket_number] += 1
-
-    def transform(position, count):
-        cs_scattering = get_macroscopic_cross_section_scattering(
-            get_media([position + (bucket_width / 2), 0, 0], water_width))
-        return count * initial_neutron_flux / (
-                num_simulations * bucket_width * cs_scattering)
-
-    flux_dict = {(bucket * bucket_width + (bucket_width / 2)): transform(bucket * bucket_width, count) for bucket, count
-                 in
-                 bucket_counts.items()}
-    flux_dict = {key: value for key, value in sorted(flux_dict.items())}
-
-    flux = np.array(list(flux_dict.values()))
-    positions = np.array(list(flux_dict.keys()))
-
-    plt.plot(positions, flux, color=color, linestyle='-', linewidth=0.5, label=f"Water {water_width}cm")
+    plt.plot(positions[scored], flux[scored], color=color, linestyle='-', linewidth=0.5, label=f"Water {water_width}cm")
+    plt.fill_between(positions[scored], (flux - flux_error)[scored], (flux + flux_error)[scored], color=color,
+                     alpha=0.3)
     plt.xlabel('Distance (cm)')
     plt.ylabel('Flux ($cm^{-2}s^{-1}$)')
     plt.title('Flux over position for an initial flux of 1000$cm^{-2}s^{-1}$')
     plt.axvline(x=water_width, color=color, linestyle='--', linewidth=0.5)
-    print("Simulation done")
-    print(f"{time.time() - start_time:.2f}")
 
 
-def plot_single_collision_flux_times_4(num_simulations, num_buckets):
-    plot_single_collision_flux(num_simulations=num_simulations, num_buckets=num_buckets, water_width=5, color='brown')
-    plot_single_collision_flux(num_simulations=num_simulations, num_buckets=num_buckets, water_width=10,
-                               color='olive')
-    plot_single_collision_flux(num_simulations=num_simulations, num_buckets=num_buckets, water_width=15,
-                               color='limegreen')
-    plot_single_collision_flux(num_simulations=num_simulations, num_buckets=num_buckets, water_width=30,
-                               color='skyblue')
+def plot_single_collision_flux_times_4(all_tallies, num_simulations, num_buckets):
+    plot_single_collision_flux(all_tallies[5]["SINGLE_COLLISION_FLUX"], water_width=5, color='brown')
+    plot_single_collision_flux(all_tallies[10]["SINGLE_COLLISION_FLUX"], water_width=10, color='olive')
+    plot_single_collision_flux(all_tallies[15]["SINGLE_COLLISION_FLUX"], water_width=15, color='limegreen')
+    plot_single_collision_flux(all_tallies[30]["SINGLE_COLLISION_FLUX"], water_width=30, color='skyblue')
     plt.legend()
     file_name = f"single_collision_flux_{num_simulations}_num_buckets{num_buckets}"
     plt.savefig(f"figures/{file_name}.png", dpi=300, bbox_inches='tight')
     plt.clf()
 
 
-def plot_multiple_collision_flux_over_position(num_simulations, num_buckets, water_width, color):
-    bucket_width = 30 / num_buckets  # cm
-    bucket_counts = defaultdict(int)
+def plot_multiple_collision_flux_over_position(tally, water_width, color):
     initial_neutron_flux = 1000  # n/cm^2 s
 
-    initial_position = np.array([0, 0, 0])
-    initial_velocity = np.array([1, 0, 0])
-
-    for i in range(num_simulations):
-        result, all_multiple_interactions = simulate_multiple_collision_two_slab(initial_position, initial_velocity,
-                                                                                  water_width)
-        for interaction in all_multiple_interactions:
-            bucket_number = math.floor(interaction / bucket_width)
-            bucket_counts[bucket_number] += 1
-
-
-    def transform(position, count):
-        cs_absorbance = get_macroscopic_cross_section(
-            get_media([position + (bucket_width / 2), 0, 0], water_width))
-        return count * initial_neutron_flux / (
-                num_simulations * bucket_width * cs_absorbance)
-
-    flux_dict = {(bucket * bucket_width + (bucket_width / 2)): transform(bucket * bucket_width, count) for bucket, count
-                 in
-                 bucket_counts.items()}
-    flux_dict = {key: value for key, value in sorted(flux_dict.items())}
-
-    flux = np.array(list(flux_dict.values()))
-    positions = np.array(list(flux_dict.keys()))
+    positions = tally.get_bucket_centers()
+    flux = tally.normalize(source_intensity=initial_neutron_flux)
+    flux_error = flux * tally.get_relative_error()
+    scored = tally.sums > 0
+    print_relative_error(tally, f"Multiple collision flux, water {water_width}cm")
 
-    plt.plot(positions, flux, color=color, linestyle='-', linewidth=2, label=f"Water {water_width}cm")
+    plt.plot(positions[scored], flux[scored], color=color, linestyle='-', linewidth=2, label=f"Water {water_width}cm")
+    plt.fill_between(positions[scored], (flux - flux_error)[scored], (flux + flux_error)[scored], color=color,
+                     alpha=0.3)
     plt.xlabel('Distance (cm)')
     plt.ylabel('Flux ($cm^{-2}s^{-1}$)')
     plt.title('Flux over position for an initial flux of 1000$cm^{-2}s^{-1}$')
     plt.axvline(x=water_width, color=color, linestyle='--', linewidth=0.5)
-    print("Simulation done")
-    print(f"{time.time() - start_time:.2f}")
 
 
-def plot_multiple_collision_flux_over_position_times_4(num_simulations, num_buckets):
-    plot_multiple_collision_flux_over_position(num_simulations=num_simulations, num_buckets=num_buckets, water_width=5,
+def plot_multiple_collision_flux_over_position_times_4(all_tallies, num_simulations, num_buckets):
+    plot_multiple_collision_flux_over_position(all_tallies[5]["MULTIPLE_COLLISION_FLUX"], water_width=5,
                                                color='brown')
-    plot_multiple_collision_flux_over_position(num_simulations=num_simulations, num_buckets=num_buckets, water_width=10,
+    plot_multiple_collision_flux_over_position(all_tallies[10]["MULTIPLE_COLLISION_FLUX"], water_width=10,
                                                color='olive')
-    plot_multiple_collision_flux_over_position(num_simulations=num_simulations, num_buckets=num_buckets, water_width=15,
+    plot_multiple_collision_flux_over_position(all_tallies[15]["MULTIPLE_COLLISION_FLUX"], water_width=15,
                                                color='limegreen')
-    plot_multiple_collision_flux_over_position(num_simulations=num_simulations, num_buckets=num_buckets, water_width=30,
+    plot_multiple_collision_flux_over_position(all_tallies[30]["MULTIPLE_COLLISION_FLUX"], water_width=30,
                                                color='skyblue')
     plt.legend()
     file_name = f"multiple_collision_flux_{num_simulations}_num_buckets{num_buckets}"
@@ -174,73 +188,94 @@ def plot_multiple_collision_flux_over_position_times_4(num_simulations, num_buck
     plt.clf()
 
 
-def plot_slowing_down_density(num_simulations, num_buckets, water_width, color):
-    bucket_width = 30 / num_buckets  # cm
-    bucket_counts = defaultdict(int)
+def plot_slowing_down_density(tally, water_width, color):
     initial_neutron_flux = 1000  # n/cm^2 s
 
-    initial_position = np.array([0, 0, 0])
-    initial_velocity = np.array([1, 0, 0])
+    positions = tally.get_bucket_centers()
+    flux = tally.normalize(source_intensity=initial_neutron_flux)
+    flux_error = flux * tally.get_relative_error()
+    scored = tally.sums > 0
+    print_relative_error(tally, f"Slowing down density, water {water_width}cm")
 
-    for i in range(num_simulations):
-        result, final_position = simulate_slow_down_density_two_slab(initial_position, initial_velocity, water_width)
-        if result != "THERMALIZED":
-            continue
-
-        final_x = final_position[0]
-
-        bucket_number = math.floor(final_x / bucket_width)
-        bucket_counts[bucket_number] += 1
+    plt.plot(positions[scored], flux[scored], color=color, linestyle='-', linewidth=2, label=f"Water {water_width}cm")
+    plt.fill_between(positions[scored], (flux - flux_error)[scored], (flux + flux_error)[scored], color=color,
+                     alpha=0.3)
+    plt.xlabel('Distance (cm)')
+    plt.ylabel('Slowing down density ($cm^{-3}s^{-1}$)')
+    plt.title('Slowing down density over position for an initial flux of 1000$cm^{-2}s^{-1}$')
+    plt.axvline(x=water_width, color=color, linestyle='--', linewidth=0.5)
 
-    def transform(count):
-        return count * initial_neutron_flux / (
-                num_simulations * bucket_width)
 
-    flux_dict = {(bucket * bucket_width + (bucket_width / 2)): transform(count) for bucket, count in
-                 bucket_counts.items()}
-    flux_dict = {key: value for key, value in sorted(flux_dict.items())}
+def plot_slowing_down_density_times_4(all_tallies, num_simulations, num_buckets):
+    plot_slowing_down_density(all_tallies[5]["SLOWING_DOWN_DENSITY"], water_width=5, color='brown')
+    plot_slowing_down_density(all_tallies[10]["SLOWING_DOWN_DENSITY"], water_width=10, color='olive')
+    plot_slowing_down_density(all_tallies[15]["SLOWING_DOWN_DENSITY"], water_width=15, color='limegreen')
+    plot_slowing_down_density(all_tallies[30]["SLOWING_DOWN_DENSITY"], water_width=30, color='skyblue')
+    plt.legend()
+    file_name = f"slowing_down_density_{num_simulations}_num_buckets{num_buckets}"
+    plt.savefig(f"figures/{file_name}.png", dpi=300, bbox_inches='tight')
+    plt.clf()
 
-    flux = np.array(list(flux_dict.values()))
-    positions = np.array(list(flux_dict.keys()))
 
-    plt.plot(positions, flux, color=color, linestyle='-', linewidth=2, label=f"Water {water_width}cm")
+def plot_flux_difference_over_position(differences, num_simulations, num_buckets, water_width, color):
+    bucket_width = 30 / num_buckets  # cm
+    initial_neutron_flux = 1000  # n/cm^2 s
+    difference_counts, difference_errors = differences
+
+    # The flux tallies already score 1 / cross section per collision, in the media of each width
+    positions = np.arange(num_buckets) * bucket_width + bucket_width / 2
+    scale = initial_neutron_flux / (num_simulations * bucket_width)
+    flux_difference = difference_counts["TOTAL_FLUX"] * scale
+    flux_difference_error = difference_errors["TOTAL_FLUX"] * scale
+
+    plt.plot(positions, flux_difference, color=color, linestyle='-', linewidth=2,
+             label=f"Water {water_width}cm - Water {WATER_WIDTHS[0]}cm")
+    plt.fill_between(positions, flux_difference - flux_difference_error, flux_difference + flux_difference_error,
+                     color=color, alpha=0.3)
     plt.xlabel('Distance (cm)')
-    plt.ylabel('Slowing down density ($cm^{-3}s^{-1}$)')
-    plt.title('Slowing down density over position for an initial flux of 1000$cm^{-2}s^{-1}$')
+    plt.ylabel('Flux difference ($cm^{-2}s^{-1}$)')
+    plt.title('Flux difference to the thinnest water slab for an initial flux of 1000$cm^{-2}s^{-1}$')
     plt.axvline(x=water_width, color=color, linestyle='--', linewidth=0.5)
-    print("Simulation done")
-    print(f"{time.time() - start_time:.2f}")
 
 
-def plot_slowing_down_density_times_4(num_simulations, num_buckets):
-    plot_slowing_down_density(num_simulations=num_simulations, num_buckets=num_buckets, water_width=5, color='brown')
-    plot_slowing_down_density(num_simulations=num_simulations, num_buckets=num_buckets, water_width=10,
-                              color='olive')
-    plot_slowing_down_density(num_simulations=num_simulations, num_buckets=num_buckets, water_width=15,
-                              color='limegreen')
-    plot_slowing_down_density(num_simulations=num_simulations, num_buckets=num_buckets, water_width=30,
-                              color='skyblue')
+def plot_flux_difference_over_position_times_3(all_differences, num_simulations, num_buckets):
+    plot_flux_difference_over_position(all_differences[10], num_simulations, num_buckets, water_width=10,
+                                       color='olive')
+    plot_flux_difference_over_position(all_differences[15], num_simulations, num_buckets, water_width=15,
+                                       color='limegreen')
+    plot_flux_difference_over_position(all_differences[30], num_simulations, num_buckets, water_width=30,
+                                       color='skyblue')
     plt.legend()
-    file_name = f"slowing_down_density_{num_simulations}_num_buckets{num_buckets}"
+    file_name = f"total_flux_difference_{num_simulations}_num_buckets{num_buckets}"
     plt.savefig(f"figures/{file_name}.png", dpi=300, bbox_inches='tight')
     plt.clf()
 
 
-scale_num_simulation = 100  # 10 for standard, 100 for good results, 1 for quick test
-os.makedirs("figures", exist_ok=True)
+if __name__ == "__main__":
+    # Runs until the worst scored bin of every width is at 2% relative error, or for at most 10 minutes.
+    # CampaignTarget(time_budget=10) for a quick test.
+    target = CampaignTarget(relative_error=0.02, time_budget=600)
+    os.makedirs("figures", exist_ok=True)
+
+    # The tallies come from the result cache when the campaign already ran with the same code and parameters, a
+    # stricter target only adds the missing histories to them
+    all_tallies, all_differences, num_simulations = get_all_tallies(
+        *load_or_top_up(run_all_tallies, target=target, num_buckets=60, num_buckets_single_collision=600,
+                        flux_estimator="TRACK_LENGTH", single_collision_estimator="EXPECTED_VALUE",
+                        importances=IMPORTANCES))
 
-plot_flux_over_position_times_4(2000 * scale_num_simulation, 60)
-print("Figure 1")
-print(f"{time.time() - start_time:.2f}")
+    plot_flux_over_position_times_4(all_tallies, num_simulations, num_buckets=60)
+    print("Figure 1")
 
-plot_single_collision_flux_times_4(num_simulations=50000 * scale_num_simulation, num_buckets=600)
-print("Figure 2")
-print(f"{time.time() - start_time:.2f}")
+    plot_single_collision_flux_times_4(all_tallies, num_simulations, num_buckets=600)
+    print("Figure 2")
 
-plot_multiple_collision_flux_over_position_times_4(num_simulations=2000 * scale_num_simulation, num_buckets=60)
-print("Figure 3")
-print(f"{time.time() - start_time:.2f}")
+    plot_multiple_collision_flux_over_position_times_4(all_tallies, num_simulations, num_buckets=60)
+    print("Figure 3")
 
-plot_slowing_down_density_times_4(num_simulations=2000 * scale_num_simulation, num_buckets=60)
-print("Figure 4")
-print(f"{time.time() - start_time:.2f}")
+    plot_slowing_down_density_times_4(all_tallies, num_simulations, num_buckets=60)
+    print("Figure 4")
+
+    plot_flux_difference_over_position_times_3(all_differences, num_simulations, num_buckets=60)
+    print("Figure 5")
+    print(f"{time.time() - start_time:.2f}")
@@ -1,9 +1,12 @@
 import math
-from random import random
+from collections import namedtuple
 
+import numpy as np
 from numpy.linalg import norm as get_norm
 
-from main import elastic_collision
+from variate_pool import default_pool
+from main import elastic_collision, elastic_collision_batch
+from variance_reduction import get_split_counts, play_russian_roulette, split_particles
 
 HYDROGEN_SCATTERING_PERCENTAGE = 7.8 / 10.5
 ABSORBANCE_PERCENTAGE = 0.010063 / 0.361663
@@ -11,36 +14,45 @@ ABSORBANCE_PERCENTAGE = 0.010063 / 0.361663
 THERMALIZED_VELOCITY_THRESHOLD = 1 / math.sqrt(10 ** 6)
 # In cm-1
 MACROSCOPIC_CROSS_SECTION = 0.361663
+SLAB_THICKNESS = 30  # cm
+# Histories advanced together by the event-based engine
+BATCH_SIZE = 100000
+RESULT_DTYPE = "<U13"
 
+# Every collision of transport_batch(record_events=True): where, which history, collision number (0 for the first),
+# weight of the neutron, weight absorbed and whether the neutron thermalized there
+CollisionEvents = namedtuple("CollisionEvents", ["positions", "histories", "numbers", "weights", "absorbed_weights",
+                                                 "thermalized"])
 
-def get_distance_to_next_interaction(macroscopic_cross_section):
-    return - math.log(random()) / macroscopic_cross_section
 
+def get_distance_to_next_interaction(macroscopic_cross_section, rng=default_pool):
+    return rng.standard_exponential() / macroscopic_cross_section
 
-def get_atomic_mass_target():
-    if random() < HYDROGEN_SCATTERING_PERCENTAGE:
+
+def get_atomic_mass_target(rng=default_pool):
+    if rng.random() < HYDROGEN_SCATTERING_PERCENTAGE:
         return 1
     else:
         return 16
 
 
 def is_outside_right(position):
-    return position[0] > 30
+    return position[0] > SLAB_THICKNESS
 
 
 def is_outside_left(position):
     return position[0] < 0
 
 
-def is_absorbed():
-    return random() < ABSORBANCE_PERCENTAGE
+def is_absorbed(rng=default_pool):
+    return rng.random() < ABSORBANCE_PERCENTAGE
 
 
 def is_thermalized(v_f):
     return get_norm(v_f) < THERMALIZED_VELOCITY_THRESHOLD
 
 
-def simulate(x, v, ENERGY_ANALYSED_COLLISIONS):
+def simulate(x, v, ENERGY_ANALYSED_COLLISIONS, rng=default_pool):
     positions = []
     scattering_angles = []
     energies = []
@@ -48,17 +60,17 @@ def simulate(x, v, ENERGY_ANALYSED_COLLISIONS):
     num_collisions = 0
 
     while True:
-        distance = get_distance_to_next_interaction(MACROSCOPIC_CROSS_SECTION)
+        distance = get_distance_to_next_interaction(MACROSCOPIC_CROSS_SECTION, rng)
         x = x + ((distance / get_norm(v)) * v)
 
         if is_outside_right(x):
             return "ESCAPED_RIGHT", positions, scattering_angles, energies, num_collisions
         if is_outside_left(x):
             return "ESCAPED_LEFT", positions, scattering_angles, energies, num_collisions
-        if is_absorbed():
+        if is_absorbed(rng):
             return "ABSORBED", positions, scattering_angles, energies, num_collisions
 
-        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target())
+        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target(rng), rng)
         scattering_angles.append(theta_lab)
 
         if num_collisions < ENERGY_ANALYSED_COLLISIONS:
@@ -71,28 +83,28 @@ def simulate(x, v, ENERGY_ANALYSED_COLLISIONS):
         positions.append(x)
 
 
-def simulate_simple(x, v):
+def simulate_simple(x, v, rng=default_pool):
     while True:
-        distance = get_distance_to_next_interaction(MACROSCOPIC_CROSS_SECTION)
+        distance = get_distance_to_next_interaction(MACROSCOPIC_CROSS_SECTION, rng)
         x = x + ((distance / get_norm(v)) * v)
 
         if is_outside_right(x):
             return "ESCAPED_RIGHT", x
         if is_outside_left(x):
             return "ESCAPED_LEFT", x
-        if is_absorbed():
+        if is_absorbed(rng):
             return "ABSORBED", x
 
-        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target())
+        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target(rng), rng)
 
         if is_thermalized(v):
             return "THERMALIZED", x
 
 
-def simulate_multiple_collision(x, v):
+def simulate_multiple_collision(x, v, rng=default_pool):
     collisions = 0
     while True:
-        distance = get_distance_to_next_interaction(MACROSCOPIC_CROSS_SECTION)
+        distance = get_distance_to_next_interaction(MACROSCOPIC_CROSS_SECTION, rng)
         x = x + ((distance / get_norm(v)) * v)
 
         if is_outside_right(x):
@@ -102,21 +114,169 @@ def simulate_multiple_collision(x, v):
 
         collisions += 1
 
-        if is_absorbed():
+        if is_absorbed(rng):
             return "ABSORBED", x, collisions
 
-        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target())
+        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target(rng), rng)
 
         if is_thermalized(v):
             return "THERMALIZED", x, collisions
 
 
-def simulate_single_collision(x, v):
-    distance = get_distance_to_next_interaction(MACROSCOPIC_CROSS_SECTION)
+def simulate_single_collision(x, v, rng=default_pool):
+    distance = get_distance_to_next_interaction(MACROSCOPIC_CROSS_SECTION, rng)
     x = x + ((distance / get_norm(v)) * v)
 
     if is_outside_right(x):
         return "ESCAPED_RIGHT", x
-    if is_absorbed():
+    if is_absorbed(rng):
         return "ABSORBED", x
     return "OTHER", x
+
+
+def get_batch_sizes(num_simulations, batch_size=BATCH_SIZE):
+    for start in range(0, num_simulations, batch_size):
+        yield min(batch_size, num_simulations - start)
+
+
+def get_atomic_mass_targets(num_targets, rng=np.random):
+    return np.where(rng.random(num_targets) < HYDROGEN_SCATTERING_PERCENTAGE, 1, 16)
+
+
+def transport_batch(x, v, num_simulations, rng=np.random, energy_analysed_collisions=0, record_collisions=False,
+                    record_events=False, weight_window=None, max_collisions=None):
+    # Particle bank, structure of arrays. Terminated histories are compacted out after every step.
+    # Speed and direction are carried separately.
+    # weight_window (variance_reduction.WeightWindow) replaces analog absorption by survival biasing, Russian
+    # roulette and splitting, use the collision events (record_events) to score the weights. max_collisions stops the
+    # neutrons after that many collisions, with result "OTHER".
+    positions = np.tile(np.asarray(x, dtype=float), (num_simulations, 1))
+    directions = np.tile(np.asarray(v, dtype=float) / get_norm(v), (num_simulations, 1))
+    speeds = np.full(num_simulations, get_norm(v), dtype=float)
+    histories = np.arange(num_simulations)
+    interactions = np.zeros(num_simulations, dtype=int)
+    weights = np.ones(num_simulations)
+
+    results = np.full(num_simulations, "OTHER", dtype=RESULT_DTYPE)
+    final_positions = np.empty((num_simulations, 3))
+    num_interactions = np.zeros(num_simulations, dtype=int)
+    energies = np.full((num_simulations, energy_analysed_collisions), np.nan)
+    collision_log = []
+    event_log = []
+
+    while histories.size:
+        num_alive = histories.size
+        distances = rng.standard_exponential(num_alive) / MACROSCOPIC_CROSS_SECTION
+        positions = positions + distances[:, None] * directions
+
+        escaped_right = positions[:, 0] > SLAB_THICKNESS
+        escaped_left = ~escaped_right & (positions[:, 0] < 0)
+        collided = ~(escaped_right | escaped_left)
+        interactions = interactions + collided
+        # Absorption test, or Russian roulette with weights
+        uniforms = rng.random(num_alive)
+        collision_weights = weights[collided]
+        if weight_window is None:
+            absorbed = collided & (uniforms < ABSORBANCE_PERCENTAGE)
+            absorbed_weights = collision_weights * absorbed[collided]
+        else:
+            absorbed = np.zeros_like(collided)
+            absorbed_weights = collision_weights * ABSORBANCE_PERCENTAGE
+            weights = weights.copy()
+            weights[collided] -= absorbed_weights
+        scattered = collided & ~absorbed
+        stopped = scattered & (interactions == max_collisions)
+        collision_thermalized = np.zeros(collision_weights.size, dtype=bool)
+        if record_events:
+            event_log.append(CollisionEvents(positions[collided], histories[collided], interactions[collided] - 1,
+                                             collision_weights, absorbed_weights, collision_thermalized))
+
+        for result, terminated in (("ESCAPED_RIGHT", escaped_right), ("ESCAPED_LEFT", escaped_left),
+                                   ("ABSORBED", absorbed), ("OTHER", stopped)):
+            results[histories[terminated]] = result
+            final_positions[histories[terminated]] = positions[terminated]
+            num_interactions[histories[terminated]] = interactions[terminated]
+
+        scattered &= ~stopped
+        scattered_collisions = np.flatnonzero(scattered[collided])
+        positions = positions[scattered]
+        directions = directions[scattered]
+        speeds = speeds[scattered]
+        histories = histories[scattered]
+        interactions = interactions[scattered]
+        weights = weights[scattered]
+        uniforms = uniforms[scattered]
+
+        directions, speeds, cos_theta_lab = elastic_collision_batch(
+            directions, speeds, get_atomic_mass_targets(histories.size, rng), rng)
+        energy = speeds ** 2
+
+        # Scatterings so far, this one included
+        num_collisions = interactions
+        analysed = num_collisions <= energy_analysed_collisions
+        energies[histories[analysed], num_collisions[analysed] - 1] = energy[analysed]
+        if record_collisions:
+            collision_log.append((histories, positions, np.arccos(cos_theta_lab)))
+
+        thermalized = speeds < THERMALIZED_VELOCITY_THRESHOLD
+        results[histories[thermalized]] = "THERMALIZED"
+        final_positions[histories[thermalized]] = positions[thermalized]
+        num_interactions[histories[thermalized]] = interactions[thermalized]
+        collision_thermalized[scattered_collisions[thermalized]] = True
+
+        positions = positions[~thermalized]
+        directions = directions[~thermalized]
+        speeds = speeds[~thermalized]
+        histories = histories[~thermalized]
+        interactions = interactions[~thermalized]
+        weights = weights[~thermalized]
+
+        if weight_window is not None:
+            survived, weights = play_russian_roulette(weights, uniforms[~thermalized], weight_window)
+            split_counts = get_split_counts(weights[survived], weight_window)
+            positions, directions, speeds, histories, interactions, weights = split_particles(
+                split_counts, positions[survived], directions[survived], speeds[survived], histories[survived],
+                interactions[survived], weights[survived] / split_counts)
+
+    collision_events = CollisionEvents(*map(np.concatenate, zip(*event_log))) if record_events else None
+    return results, final_positions, num_interactions, energies, collision_log, collision_events
+
+
+def simulate_batch(x, v, num_simulations, ENERGY_ANALYSED_COLLISIONS, rng=np.random):
+    results, final_positions, num_interactions, energies, collision_log, _ = transport_batch(
+        x, v, num_simulations, rng, energy_analysed_collisions=ENERGY_ANALYSED_COLLISIONS, record_collisions=True)
+    num_collisions = num_interactions - (results == "ABSORBED")
+    collision_histories = np.concatenate([histories for histories, _, _ in collision_log] or [np.empty(0, int)])
+    positions = np.concatenate([positions for _, positions, _ in collision_log] or [np.empty((0, 3))])
+    scattering_angles = np.concatenate([angles for _, _, angles in collision_log] or [np.empty(0)])
+    # Collisions ordered by history, then by collision number
+    order = np.argsort(collision_histories, kind="stable")
+    return (results, collision_histories[order], positions[order], scattering_angles[order], energies,
+            num_collisions)
+
+
+def simulate_simple_batch(x, v, num_simulations, rng=np.random):
+    results, final_positions, _, _, _, _ = transport_batch(x, v, num_simulations, rng)
+    return results, final_positions
+
+
+def simulate_multiple_collision_batch(x, v, num_simulations, rng=np.random):
+    results, final_positions, collisions, _, _, _ = transport_batch(x, v, num_simulations, rng)
+    return results, final_positions, collisions
+
+
+def simulate_collision_events_batch(x, v, num_simulations, rng=np.random, weight_window=None, max_collisions=None):
+    *_, collision_events = transport_batch(x, v, num_simulations, rng, record_events=True, weight_window=weight_window,
+                                           max_collisions=max_collisions)
+    return collision_events
+
+
+def simulate_single_collision_batch(x, v, num_simulations, rng=np.random):
+    velocity = np.asarray(v, dtype=float)
+    distances = rng.standard_exponential(num_simulations) / MACROSCOPIC_CROSS_SECTION
+    final_positions = np.asarray(x, dtype=float) + (distances / get_norm(velocity))[:, None] * velocity
+
+    results = np.full(num_simulations, "OTHER", dtype=RESULT_DTYPE)
+    results[rng.random(num_simulations) < ABSORBANCE_PERCENTAGE] = "ABSORBED"
+    results[final_positions[:, 0] > SLAB_THICKNESS] = "ESCAPED_RIGHT"
+    return results, final_positions
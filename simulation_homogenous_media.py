@@ -1,60 +1,126 @@
 import math
-from random import random
 
+import numpy as np
 from numpy.linalg import norm as get_norm
 
+from variate_pool import default_pool
 from main import elastic_collision
+from materials import Material, MaterialTable
+from simulation import RESULT_DTYPE
+from variance_reduction import play_russian_roulette
 
 HYDROGEN_SCATTERING_PERCENTAGE = 7.8 / 10.5
 ABSORBANCE_PERCENTAGE = 0.010063 / 0.361663
 # Unitless, initial velocity 1MeV, thermalized velocity threshold 1eV
 THERMALIZED_VELOCITY_THRESHOLD = 1 / math.sqrt(10 ** 6)
+# Lethargy ln(E0 / E) of the same threshold
+THERMALIZED_LETHARGY = math.log(10 ** 6)
 # In cm-1
 MACROSCOPIC_CROSS_SECTION = 0.361663
+# Only the nuclides of hydrogen and oxygen are used, there is no transport in them
+MATERIALS = MaterialTable([
+    Material("WATER", MACROSCOPIC_CROSS_SECTION, MACROSCOPIC_CROSS_SECTION * (1 - ABSORBANCE_PERCENTAGE),
+             MACROSCOPIC_CROSS_SECTION * ABSORBANCE_PERCENTAGE, [1, 16],
+             [HYDROGEN_SCATTERING_PERCENTAGE, 1 - HYDROGEN_SCATTERING_PERCENTAGE]),
+    Material("HYDROGEN", math.nan, math.nan, 0, [1], [1]),
+    Material("OXYGEN", math.nan, math.nan, 0, [16], [1]),
+])
+WATER = MATERIALS.get_id("WATER")
 
 
-def get_distance_to_next_interaction(macroscopic_cross_section):
-    return - math.log(random()) / macroscopic_cross_section
+def get_distance_to_next_interaction(macroscopic_cross_section, rng=default_pool):
+    return rng.standard_exponential() / macroscopic_cross_section
 
 
-def get_atomic_mass_target(medium):
-    if medium == "OXYGEN":
-        return 16
-    elif medium == "HYDROGEN":
-        return 1
-    elif random() < HYDROGEN_SCATTERING_PERCENTAGE:
-        return 1
-    else:
-        return 16
+def get_atomic_mass_target(material, rng=default_pool):
+    return MATERIALS.sample_nuclide_mass(material, rng)
 
 
-def is_absorbed():
-    return random() < ABSORBANCE_PERCENTAGE
+def is_absorbed(material, rng=default_pool):
+    return MATERIALS.is_absorbed(material, rng)
 
 
 def is_thermalized(v_f):
     return get_norm(v_f) < THERMALIZED_VELOCITY_THRESHOLD
 
 
-def simulate_water_simple_with_absorbance(v):
+def simulate_water_simple_with_absorbance(v, rng=default_pool):
     num_collisions = 0
-    medium = "WATER"
     while True:
         num_collisions += 1
-        if is_absorbed():
+        if is_absorbed(WATER, rng):
             return "ABSORBED", num_collisions
 
-        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target(medium))
+        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target(WATER, rng), rng)
 
         if is_thermalized(v):
             return "THERMALIZED", num_collisions
 
 
-def simulate_homogenous_without_absorbance(v, medium):
+def simulate_homogenous_without_absorbance(v, medium, rng=default_pool):
+    # medium: material name, looked up once
+    material = MATERIALS.get_id(medium)
     num_collisions = 0
     while True:
         num_collisions += 1
-        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target(medium))
+        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target(material, rng), rng)
 
         if is_thermalized(v):
             return num_collisions
+
+
+def get_energy_ratios(mass_targets, uniforms):
+    # Isotropic scattering in CM: E'/E is uniform between alpha = ((A - 1) / (A + 1))^2 and 1
+    alphas = ((mass_targets - 1) / (mass_targets + 1)) ** 2
+    return 1 - (1 - alphas) * uniforms
+
+
+def slow_down_batch(num_simulations, medium, rng=np.random, with_absorbance=False, weight_window=None):
+    # Infinite medium: the position and direction of a neutron never matter, only its lethargy is followed. All the
+    # histories start together, so the neutrons still alive at a step have all had the same number of collisions.
+    # Returns how every history ended ("ABSORBED", "THERMALIZED" or "KILLED" by Russian roulette), its number of
+    # collisions, absorption included, and its weight when it ended.
+    # weight_window (variance_reduction.WeightWindow): survival biasing and Russian roulette instead of analog
+    # absorption. Weights never grow here, so no neutron is split.
+    material = MATERIALS.get_id(medium)
+    lethargies = np.zeros(num_simulations)
+    histories = np.arange(num_simulations)
+    weights = np.ones(num_simulations)
+    results = np.full(num_simulations, "THERMALIZED", dtype=RESULT_DTYPE)
+    num_collisions = np.zeros(num_simulations, dtype=int)
+    final_weights = np.ones(num_simulations)
+    collisions = 0
+
+    # Single nuclide media and runs without absorption draw fewer random numbers
+    nuclide_masses = MATERIALS.nuclide_mass_lists[material]
+    while histories.size:
+        collisions += 1
+        if with_absorbance and weight_window is None:
+            absorbed = MATERIALS.are_absorbed(material, rng.random(histories.size))
+        else:
+            absorbed = np.zeros(histories.size, dtype=bool)
+        if with_absorbance and weight_window is not None:
+            # Survival biasing
+            weights = weights * (1 - MATERIALS.absorption_ratio_list[material])
+        if len(nuclide_masses) == 1:
+            mass_targets = nuclide_masses[0]
+        else:
+            mass_targets = MATERIALS.sample_nuclide_masses(material, rng.random(histories.size))
+        lethargies -= np.log(get_energy_ratios(mass_targets, rng.random(histories.size)))
+
+        thermalized = ~absorbed & (lethargies > THERMALIZED_LETHARGY)
+        killed = np.zeros(histories.size, dtype=bool)
+        if weight_window is not None:
+            survived, roulette_weights = play_russian_roulette(weights, rng.random(histories.size), weight_window)
+            killed = ~thermalized & ~survived
+            weights = np.where(thermalized, weights, roulette_weights)
+        terminated = absorbed | thermalized | killed
+        results[histories[absorbed]] = "ABSORBED"
+        results[histories[killed]] = "KILLED"
+        num_collisions[histories[terminated]] = collisions
+        final_weights[histories[thermalized]] = weights[thermalized]
+        lethargies = lethargies[~terminated]
+        histories = histories[~terminated]
+        weights = weights[~terminated]
+
+    return results, num_collisions, final_weights
@@ -1,9 +1,19 @@
 import math
-from random import random
+from collections import namedtuple
+from functools import lru_cache
 
+import numpy as np
 from numpy.linalg import norm as get_norm
 
-from main import elastic_collision
+from variate_pool import default_pool
+from cross_sections import EnergyMaterial, EnergyMaterialTable, load_nuclide, select_grid_index, SOURCE_ENERGY
+from geometry import Layer, SlabGeometry
+from main import elastic_collision, elastic_collision_batch
+from materials import Material, MaterialTable
+from random_streams import CounterStream, get_split_particles
+from simulation import RESULT_DTYPE
+from variance_reduction import get_importance_split_counts, get_split_counts, get_split_uniforms, \
+    play_russian_roulette, split_particles
 
 MACROSCOPIC_CS_ABSORPTION_WATER = 0.010063
 MACROSCOPIC_CS_ABSORPTION_CARBON = 0.00026
@@ -11,131 +21,109 @@ MACROSCOPIC_CS_SCATTERING_WATER = 0.361663 - 0.010063
 MACROSCOPIC_CS_SCATTERING_CARBON = 0.3846
 
 HYDROGEN_SCATTERING_PERCENTAGE = 7.8 / 10.5
-ABSORBANCE_RATIO_WATER = MACROSCOPIC_CS_ABSORPTION_WATER / 0.361663
-ABSORBANCE_RATIO_CARBON = MACROSCOPIC_CS_ABSORPTION_CARBON / (0.3846 + MACROSCOPIC_CS_ABSORPTION_CARBON)
 # Unitless, initial velocity 1MeV, thermalized velocity threshold 1eV
 THERMALIZED_VELOCITY_THRESHOLD = 1 / math.sqrt(10 ** 6)
 # In cm-1
 MACROSCOPIC_CROSS_SECTION_WATER = 0.361663
 MACROSCOPIC_CROSS_SECTION_CARBON = 0.3846 + MACROSCOPIC_CS_ABSORPTION_CARBON  # cm-1
-
-
-def get_media(x, water_width):
-    position = x[0]
-    if position < 0 or position > 30:
-        return "VOID"
-    elif position < water_width:
-        return "WATER"
-    else:
-        return "CARBON"
-
-
-def get_macroscopic_cross_section(current_media):
-    if current_media == "WATER":
-        return MACROSCOPIC_CROSS_SECTION_WATER
-    else:
-        # Using the same cross-section for carbon and void, but it is not relevant.
-        return MACROSCOPIC_CROSS_SECTION_CARBON
-
-
-def get_macroscopic_cross_section_absorbance(current_media):
-    if current_media == "WATER":
-        return MACROSCOPIC_CS_ABSORPTION_WATER
-    else:
-        # Using the same cross-section for carbon and void, but it is not relevant.
-        return MACROSCOPIC_CS_ABSORPTION_CARBON
-
-
-def get_macroscopic_cross_section_scattering(current_media):
-    if current_media == "WATER":
-        return MACROSCOPIC_CS_SCATTERING_WATER
-    else:
-        # Using the same cross-section for carbon and void, but it is not relevant.
-        return MACROSCOPIC_CS_SCATTERING_CARBON
-
-
-def get_other_macroscopic_cross_section(current_media):
-    if current_media == "WATER":
-        return MACROSCOPIC_CROSS_SECTION_CARBON
-    else:
-        return MACROSCOPIC_CROSS_SECTION_WATER
-
-
-def get_next_position(current_position, v, water_width):
-    current_media = get_media(current_position, water_width)
-    macroscopic_cross_section = get_macroscopic_cross_section(current_media)
-    minus_log_r = - math.log(random())
-    distance_to_next_interaction = minus_log_r / macroscopic_cross_section
-    next_position = current_position + ((distance_to_next_interaction / get_norm(v)) * v)
-
-    next_media = get_media(next_position, water_width)
-
-    if next_media == current_media:
-        return next_position
-    if v[0] > 0 and current_position[0] > water_width:  # Escaped right
-        return next_position
-    if v[0] < 0 and current_position[0] < water_width:  # Escaped left
-        return next_position
-    else:  # Media change from water to graphite or the other way around.
-        next_macroscopic_cs = get_other_macroscopic_cross_section(current_media)
-
-        position_change_medium = current_position + v * ((water_width - current_position[0]) / v[0])
-        # print("####################### Start #####################")
-        # print(f"Current position is : {current_position}")
-        # print(f"Previous next position is : {next_position}")
-        # print(f"The position_change_medium is : {position_change_medium}")
-        # print(f"Velocity is : {v}")
-
-        d1 = get_norm(position_change_medium - current_position)
-        # print(f"d1 : {d1}")
-        d2 = (minus_log_r - d1 * macroscopic_cross_section) / next_macroscopic_cs
-        # print(f"d2 : {d2}")
-        dt = d1 + d2
-        # print(f"dt : {dt}")
-        # print(f"Previous dt : {distance_to_next_interaction}")
-
-        next_position = current_position + ((dt / get_norm(v)) * v)
-        # print(f"Recalculated next position is : {next_position}")
-
-        return next_position
-
-
-def get_atomic_mass_target(x, water_width):
-    media = get_media(x, water_width)
-
-    if media == "WATER":
-        if random() < HYDROGEN_SCATTERING_PERCENTAGE:
-            return 1
-        else:
-            return 16
-    elif media == "CARBON":
-        return 12
+SLAB_THICKNESS = 30  # cm, water and carbon together
+# Material IDs, the geometry uses VOID (0) around the slabs
+VOID = 0
+WATER = 1
+CARBON = 2
+MATERIALS = MaterialTable([
+    Material("VOID", 0, 0, 0, [], []),
+    Material("WATER", MACROSCOPIC_CROSS_SECTION_WATER, MACROSCOPIC_CS_SCATTERING_WATER,
+             MACROSCOPIC_CS_ABSORPTION_WATER, [1, 16],
+             [HYDROGEN_SCATTERING_PERCENTAGE, 1 - HYDROGEN_SCATTERING_PERCENTAGE]),
+    Material("CARBON", MACROSCOPIC_CROSS_SECTION_CARBON, MACROSCOPIC_CS_SCATTERING_CARBON,
+             MACROSCOPIC_CS_ABSORPTION_CARBON, [12], [1]),
+])
+# Atoms per barn-cm, for the energy dependent cross sections
+NUMBER_DENSITY_WATER_HYDROGEN = 0.06686
+NUMBER_DENSITY_WATER_OXYGEN = 0.03343
+NUMBER_DENSITY_CARBON = 0.0802
+NUM_STEP_UNIFORMS = 5
+
+# Everything a batch of histories did: how each history ended and where, every collision site in flight order with
+# the cross sections of its media at the neutron energy, and every flight segment (x at both ends and path length).
+# Collisions and flights carry the weight of their neutron, the weight absorbed at a collision and whether the
+# neutron thermalized there. Analog neutrons have weight 1 and absorb all of it or nothing. The geometry and the
+# source neutron of every history (x, direction along x and cross sections of every region at its energy) are kept
+# for the expected value estimators.
+TransportEvents = namedtuple("TransportEvents", ["results", "final_positions", "collision_positions",
+                                                 "collision_numbers", "collision_absorbed", "collision_histories",
+                                                 "collision_media", "collision_total_cross_sections",
+                                                 "collision_scattering_cross_sections", "collision_weights",
+                                                 "collision_absorbed_weights", "collision_thermalized",
+                                                 "track_start_x", "track_end_x", "track_lengths", "track_weights",
+                                                 "track_histories", "geometry", "source_positions_x",
+                                                 "source_directions_x", "source_cross_sections"])
+
+
+@lru_cache
+def get_two_slab_geometry(water_width, importances=None):
+    # importances for geometry splitting: the water importance, then one importance per carbon layer, the carbon is
+    # cut in that many layers of equal thickness. (1, 4): the neutrons entering the carbon are split in 4.
+    water_importance, *carbon_importances = importances or (1.0, 1.0)
+    carbon_thickness = (SLAB_THICKNESS - water_width) / len(carbon_importances)
+    return SlabGeometry([Layer(WATER, water_width, MATERIALS.get_cross_sections(WATER), water_importance)]
+                        + [Layer(CARBON, carbon_thickness, MATERIALS.get_cross_sections(CARBON), carbon_importance)
+                           for carbon_importance in carbon_importances])
+
+
+@lru_cache
+def get_material_table(cross_sections):
+    # "CONSTANT": MATERIALS, "ENERGY": tabulated cross sections from the data directory, with the same material IDs
+    if cross_sections == "CONSTANT":
+        return MATERIALS
+    elif cross_sections == "ENERGY":
+        hydrogen, oxygen, carbon = load_nuclide("H1", 1), load_nuclide("O16", 16), load_nuclide("C12", 12)
+        return EnergyMaterialTable([
+            EnergyMaterial("VOID", [], []),
+            EnergyMaterial("WATER", [hydrogen, oxygen],
+                           [NUMBER_DENSITY_WATER_HYDROGEN, NUMBER_DENSITY_WATER_OXYGEN]),
+            EnergyMaterial("CARBON", [carbon], [NUMBER_DENSITY_CARBON]),
+        ])
+    raise ValueError(f"Unknown cross sections {cross_sections}")
+
+
+def get_material(x, water_width):
+    geometry = get_two_slab_geometry(water_width)
+    return geometry.material_list[geometry.get_region(x[0])]
+
+
+def get_next_position(current_position, v, water_width, rng=default_pool):
+    direction = v / get_norm(v)
+    distance = get_two_slab_geometry(water_width).get_flight_distance(current_position[0], direction[0],
+                                                                      rng.standard_exponential())
+    return current_position + distance * direction
+
+
+def get_atomic_mass_target(x, water_width, rng=default_pool):
+    return MATERIALS.sample_nuclide_mass(get_material(x, water_width), rng)
 
 
 def is_outside_right(position):
-    return position[0] > 30
+    return position[0] > SLAB_THICKNESS
 
 
 def is_outside_left(position):
     return position[0] < 0
 
 
-def is_absorbed(x, water_width):
-    media = get_media(x, water_width)
-    if media == "WATER":
-        return random() < ABSORBANCE_RATIO_WATER
-    elif media == "CARBON":
-        return random() < ABSORBANCE_RATIO_CARBON
+def is_absorbed(x, water_width, rng=default_pool):
+    return MATERIALS.is_absorbed(get_material(x, water_width), rng)
 
 
 def is_thermalized(v_f):
     return get_norm(v_f) < THERMALIZED_VELOCITY_THRESHOLD
 
 
-def simulate_simple_two_slab(x, v, water_width):
+def simulate_simple_two_slab(x, v, water_width, rng=default_pool):
     results=[]
     while True:
-        x = get_next_position(x, v, water_width)
+        x = get_next_position(x, v, water_width, rng)
 
         if is_outside_right(x):
             return "ESCAPED_RIGHT", results
@@ -144,46 +132,46 @@ def simulate_simple_two_slab(x, v, water_width):
 
         results.append(x[0])
 
-        if is_absorbed(x, water_width):
+        if is_absorbed(x, water_width, rng):
             return "ABSORBED", results
 
-        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target(x, water_width))
+        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target(x, water_width, rng), rng)
 
         if is_thermalized(v):
             return "THERMALIZED", results
 
-def simulate_slow_down_density_two_slab(x, v, water_width):
+def simulate_slow_down_density_two_slab(x, v, water_width, rng=default_pool):
     while True:
-        x = get_next_position(x, v, water_width)
+        x = get_next_position(x, v, water_width, rng)
 
         if is_outside_right(x):
             return "ESCAPED_RIGHT", x
         if is_outside_left(x):
             return "ESCAPED_LEFT", x
-        if is_absorbed(x, water_width):
+        if is_absorbed(x, water_width, rng):
             return "ABSORBED", x
 
-        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target(x, water_width))
+        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target(x, water_width, rng), rng)
 
         if is_thermalized(v):
             return "THERMALIZED", x
 
 
-def simulate_single_collision_two_slab(x, v, water_width):
-    x = get_next_position(x, v, water_width)
+def simulate_single_collision_two_slab(x, v, water_width, rng=default_pool):
+    x = get_next_position(x, v, water_width, rng)
 
     if is_outside_right(x):
         return "ESCAPED_RIGHT", x
-    if is_absorbed(x, water_width):
+    if is_absorbed(x, water_width, rng):
         return "ABSORBED", x
     return "OTHER", x
 
 
-def simulate_multiple_collision_two_slab(x, v, water_width):
+def simulate_multiple_collision_two_slab(x, v, water_width, rng=default_pool):
     collisions = 0
     results = []
     while True:
-        x = get_next_position(x, v, water_width)
+        x = get_next_position(x, v, water_width, rng)
 
         if is_outside_right(x):
             return "ESCAPED_RIGHT", results
@@ -195,10 +183,246 @@ def simulate_multiple_collision_two_slab(x, v, water_width):
 
         collisions += 1
 
-        if is_absorbed(x, water_width):
+        if is_absorbed(x, water_width, rng):
             return "ABSORBED", results
 
-        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target(x, water_width))
+        v, theta_lab, energy = elastic_collision(v, get_atomic_mass_target(x, water_width, rng), rng)
 
         if is_thermalized(v):
             return "THERMALIZED", results
+
+
+def get_next_positions(current_positions, directions, geometry, minus_log_r, region_cross_sections=None):
+    distances = geometry.get_flight_distances(current_positions[:, 0], directions[:, 0], minus_log_r,
+                                              region_cross_sections)
+    return current_positions + distances[:, None] * directions
+
+
+def draw_step_uniforms(rng, histories, step, num_dimensions=NUM_STEP_UNIFORMS, particles=None):
+    # Rows: flight, absorption (Russian roulette with weights), target nucleus, the two collision uniforms of
+    # elastic_collision_batch, then the virtual collision test of delta tracking and the importance game
+    if isinstance(rng, CounterStream):
+        return rng.uniforms(histories, step, num_dimensions, particles)
+    return rng.random((num_dimensions, histories.size))
+
+
+def get_next_positions_delta_tracking(current_positions, directions, majorant_cross_sections, minus_log_r):
+    # Flights sampled with the majorant cross section, no interface to look for
+    return current_positions + (minus_log_r / majorant_cross_sections)[:, None] * directions
+
+
+def are_real_collisions(total_cross_sections, majorant_cross_sections, uniforms):
+    return uniforms * majorant_cross_sections < total_cross_sections
+
+
+def transport_two_slab_batch(x, v, num_simulations, water_width, rng=np.random, max_flights=None,
+                             tracking="SURFACE", cross_sections="CONSTANT", weight_window=None, importances=None):
+    # tracking="SURFACE" stops flights at the water/carbon interface, tracking="DELTA" (Woodcock) samples flights with
+    # the majorant cross section and turns a fraction of the collisions into virtual ones, which leave the neutron
+    # untouched. Both give the same tallies. max_flights counts real collisions.
+    # cross_sections="ENERGY" uses energy dependent cross sections, see get_material_table. The energy of every
+    # neutron is located on the union grid once per flight, its cross sections in every region follow from that.
+    # weight_window (variance_reduction.WeightWindow) replaces analog absorption by survival biasing, Russian
+    # roulette and splitting. results and final_positions then only describe the last neutron of each history to
+    # stop, the tallies use the weighted collision and flight records.
+    # importances (see get_two_slab_geometry) turns on geometry splitting: a neutron that ends its flight in a layer
+    # of another importance is split or rouletted there (variance_reduction.get_importance_split_counts). With a
+    # weight window too, the window applies to the weights times the importance of their layer.
+    delta_tracking = tracking == "DELTA"
+    geometry = get_two_slab_geometry(water_width, importances)
+    materials = get_material_table(cross_sections)
+    num_step_uniforms = NUM_STEP_UNIFORMS + 2 if importances is not None else NUM_STEP_UNIFORMS + delta_tracking
+
+    # Particle bank, structure of arrays. Terminated histories are compacted out after every step.
+    # Speed and direction are carried separately.
+    positions = np.tile(np.asarray(x, dtype=float), (num_simulations, 1))
+    directions = np.tile(np.asarray(v, dtype=float) / get_norm(v), (num_simulations, 1))
+    speeds = np.full(num_simulations, get_norm(v), dtype=float)
+    histories = np.arange(num_simulations)
+    num_collisions = np.zeros(num_simulations, dtype=int)
+    weights = np.ones(num_simulations)
+    particles = np.zeros(num_simulations, dtype=np.uint64)
+    particle_importances = geometry.importances[geometry.get_regions(positions[:, 0])]
+
+    results = np.full(num_simulations, "OTHER", dtype=RESULT_DTYPE)
+    final_positions = np.empty((num_simulations, 3))
+    collision_positions = []
+    collision_numbers = []
+    collision_absorbed = []
+    collision_histories = []
+    collision_media = []
+    collision_total_cross_sections = []
+    collision_scattering_cross_sections = []
+    collision_weights = []
+    collision_absorbed_weights = []
+    collision_thermalized = []
+    track_start_x = []
+    track_end_x = []
+    track_lengths = []
+    track_weights = []
+    track_histories = []
+    source_positions_x = positions[:, 0]
+    source_directions_x = directions[:, 0]
+    source_grid_index = materials.locate_energies(speeds ** 2 * SOURCE_ENERGY)
+    if source_grid_index is None:
+        source_cross_sections = np.broadcast_to(geometry.total_cross_sections, (num_simulations, geometry.num_regions))
+    else:
+        source_cross_sections = materials.get_total_cross_sections(geometry.materials[None, :], source_grid_index)
+    num_steps = 0
+
+    while histories.size:
+        uniforms = draw_step_uniforms(rng, histories, num_steps, num_step_uniforms, particles)
+        start_positions = positions
+        grid_index = materials.locate_energies(speeds ** 2 * SOURCE_ENERGY)
+        if grid_index is None:
+            region_cross_sections = None
+            majorant_cross_sections = np.full(histories.size, geometry.majorant_cross_section)
+        else:
+            region_cross_sections = materials.get_total_cross_sections(geometry.materials[None, :], grid_index)
+            majorant_cross_sections = region_cross_sections.max(axis=1)
+        if delta_tracking:
+            positions = get_next_positions_delta_tracking(positions, directions, majorant_cross_sections,
+                                                          -np.log(1 - uniforms[0]))
+        else:
+            positions = get_next_positions(positions, directions, geometry, -np.log(1 - uniforms[0]),
+                                           region_cross_sections)
+        num_steps += 1
+        track_start_x.append(start_positions[:, 0])
+        track_end_x.append(positions[:, 0])
+        track_lengths.append(get_norm(positions - start_positions, axis=1))
+        track_weights.append(weights)
+        track_histories.append(histories)
+
+        escaped_right = positions[:, 0] > geometry.right
+        escaped_left = ~escaped_right & (positions[:, 0] < geometry.left)
+        collided = ~(escaped_right | escaped_left)
+        if max_flights == 1:
+            # Single collision scoring does not look for left leakage
+            escaped_left[:] = False
+            collided = ~escaped_right
+        media = geometry.get_materials(positions[collided, 0])
+        collided_grid_index = select_grid_index(grid_index, collided)
+        total_cross_sections = materials.get_total_cross_sections(media, collided_grid_index)
+        virtual = np.zeros_like(collided)
+        if delta_tracking:
+            real = are_real_collisions(total_cross_sections, majorant_cross_sections[collided], uniforms[5, collided])
+            virtual[collided] = ~real
+            collided &= ~virtual
+            media = media[real]
+            collided_grid_index = select_grid_index(collided_grid_index, real)
+            total_cross_sections = total_cross_sections[real]
+        collision_positions.append(positions[collided, 0])
+        collision_numbers.append(num_collisions[collided])
+        collision_histories.append(histories[collided])
+        collision_media.append(media)
+        collision_total_cross_sections.append(total_cross_sections)
+        collision_scattering_cross_sections.append(materials.get_scattering_cross_sections(media,
+                                                                                           collided_grid_index))
+
+        collision_weights.append(weights[collided])
+        absorbed = collided.copy()
+        if weight_window is None:
+            absorbed[collided] = materials.are_absorbed(media, uniforms[1, collided], collided_grid_index)
+            collision_absorbed_weights.append(weights[collided] * absorbed[collided])
+        else:
+            # Survival biasing: the neutron goes on with its scattered weight
+            absorbed[collided] = False
+            absorbed_weights = weights[collided] * materials.get_absorption_ratios(media, collided_grid_index)
+            collision_absorbed_weights.append(absorbed_weights)
+            weights = weights.copy()
+            weights[collided] -= absorbed_weights
+        scattered = collided & ~absorbed
+        collision_absorbed.append(absorbed[collided])
+        step_thermalized = np.zeros(media.size, dtype=bool)
+        collision_thermalized.append(step_thermalized)
+        num_collisions[collided] += 1
+        stopped = scattered & (num_collisions == max_flights)
+
+        for result, terminated in (("ESCAPED_RIGHT", escaped_right), ("ESCAPED_LEFT", escaped_left),
+                                   ("ABSORBED", absorbed)):
+            results[histories[terminated]] = result
+            final_positions[histories[terminated]] = positions[terminated]
+        final_positions[histories[stopped]] = positions[stopped]
+
+        alive = (scattered & ~stopped) | virtual
+        scattered_collisions = np.flatnonzero((scattered & ~stopped)[collided])
+        scattered_media = media[scattered_collisions]
+        scattered_grid_index = select_grid_index(collided_grid_index, scattered_collisions)
+        scattered = scattered[alive]
+        positions = positions[alive]
+        directions = directions[alive]
+        speeds = speeds[alive]
+        histories = histories[alive]
+        num_collisions = num_collisions[alive]
+        weights = weights[alive]
+        particles = particles[alive]
+        particle_importances = particle_importances[alive]
+        uniforms = uniforms[:, alive]
+
+        mass_targets = materials.sample_nuclide_masses(scattered_media, uniforms[2, scattered], scattered_grid_index)
+        directions[scattered], speeds[scattered], cos_theta_lab = elastic_collision_batch(
+            directions[scattered], speeds[scattered], mass_targets, uniforms=uniforms[3:5, scattered])
+
+        thermalized = scattered & (speeds < THERMALIZED_VELOCITY_THRESHOLD)
+        results[histories[thermalized]] = "THERMALIZED"
+        final_positions[histories[thermalized]] = positions[thermalized]
+        step_thermalized[scattered_collisions[thermalized[scattered]]] = True
+
+        positions = positions[~thermalized]
+        directions = directions[~thermalized]
+        speeds = speeds[~thermalized]
+        histories = histories[~thermalized]
+        num_collisions = num_collisions[~thermalized]
+        weights = weights[~thermalized]
+        particles = particles[~thermalized]
+        particle_importances = particle_importances[~thermalized]
+        roulette_uniforms = uniforms[1, ~thermalized]
+
+        if importances is not None:
+            region_importances = geometry.importances[geometry.get_regions(positions[:, 0])]
+            importance_ratios = region_importances / particle_importances
+            split_counts = get_importance_split_counts(importance_ratios, uniforms[6, ~thermalized])
+            positions, directions, speeds, histories, num_collisions, weights, particle_importances = split_particles(
+                split_counts, positions, directions, speeds, histories, num_collisions, weights / importance_ratios,
+                region_importances)
+            roulette_uniforms = get_split_uniforms(split_counts, roulette_uniforms)
+            particles = get_split_particles(particles, split_counts, num_steps, stage=1)
+
+        if weight_window is not None:
+            survived, weights = play_russian_roulette(weights * particle_importances, roulette_uniforms, weight_window)
+            weights = weights / particle_importances
+            split_counts = get_split_counts(weights[survived] * particle_importances[survived], weight_window)
+            positions, directions, speeds, histories, num_collisions, weights, particle_importances = split_particles(
+                split_counts, positions[survived], directions[survived], speeds[survived], histories[survived],
+                num_collisions[survived], weights[survived] / split_counts, particle_importances[survived])
+            particles = get_split_particles(particles[survived], split_counts, num_steps)
+
+    return TransportEvents(results, final_positions, np.concatenate(collision_positions),
+                           np.concatenate(collision_numbers), np.concatenate(collision_absorbed),
+                           np.concatenate(collision_histories), np.concatenate(collision_media),
+                           np.concatenate(collision_total_cross_sections),
+                           np.concatenate(collision_scattering_cross_sections), np.concatenate(collision_weights),
+                           np.concatenate(collision_absorbed_weights), np.concatenate(collision_thermalized),
+                           np.concatenate(track_start_x), np.concatenate(track_end_x), np.concatenate(track_lengths),
+                           np.concatenate(track_weights), np.concatenate(track_histories), geometry,
+                           source_positions_x, source_directions_x, source_cross_sections)
+
+
+def simulate_simple_two_slab_batch(x, v, num_simulations, water_width, rng=np.random):
+    events = transport_two_slab_batch(x, v, num_simulations, water_width, rng)
+    return events.results, events.collision_positions
+
+
+def simulate_slow_down_density_two_slab_batch(x, v, num_simulations, water_width, rng=np.random):
+    events = transport_two_slab_batch(x, v, num_simulations, water_width, rng)
+    return events.results, events.final_positions
+
+
+def simulate_single_collision_two_slab_batch(x, v, num_simulations, water_width, rng=np.random):
+    events = transport_two_slab_batch(x, v, num_simulations, water_width, rng, max_flights=1)
+    return events.results, events.final_positions
+
+
+def simulate_multiple_collision_two_slab_batch(x, v, num_simulations, water_width, rng=np.random):
+    events = transport_two_slab_batch(x, v, num_simulations, water_width, rng)
+    return events.results, events.collision_positions[events.collision_numbers != 0]
@@ -0,0 +1,225 @@
+import numpy as np
+
+# A tally is a (select_sites, num_buckets) pair. select_sites picks the x positions it scores, the histories they
+# belong to and their weights from the TransportEvents of a batch, so one set of histories can feed any number of
+# tallies. The weights include the neutron weight, 1 for analog histories.
+
+
+class HistogramTally:
+    # Fixed bins over the slab, filled in bulk with np.bincount. Every history is a batch of its own: the tally keeps
+    # the per-bin sum and sum of squares of the history scores, which gives the relative error of every bin.
+
+    def __init__(self, num_buckets, length=30):
+        self.num_buckets = num_buckets
+        self.bucket_width = length / num_buckets  # cm
+        self.sums = np.zeros(num_buckets)
+        self.squared_sums = np.zeros(num_buckets)
+        self.num_histories = 0
+        # Independent samples, see make_batch. None: every history is a sample of its own.
+        self.num_batches = None
+
+    def get_bucket_numbers(self, positions_x):
+        bucket_numbers = np.floor(positions_x / self.bucket_width).astype(int)
+        return np.clip(bucket_numbers, 0, self.num_buckets - 1)
+
+    def get_bucket_centers(self):
+        return np.arange(self.num_buckets) * self.bucket_width + self.bucket_width / 2
+
+    def score(self, num_histories, positions_x, histories, weights=None):
+        # histories: index of the history every score belongs to, num_histories: histories run, scoring or not
+        keys = np.asarray(histories) * self.num_buckets + self.get_bucket_numbers(positions_x)
+        history_keys, key_indices = np.unique(keys, return_inverse=True)
+        history_scores = np.bincount(key_indices, weights)
+        history_buckets = history_keys % self.num_buckets
+        self.sums += np.bincount(history_buckets, history_scores, minlength=self.num_buckets)
+        self.squared_sums += np.bincount(history_buckets, history_scores ** 2, minlength=self.num_buckets)
+        self.num_histories += num_histories
+        return self
+
+    def __add__(self, other):
+        total = type(self)(self.num_buckets, self.num_buckets * self.bucket_width)
+        total.sums = self.sums + other.sums
+        total.squared_sums = self.squared_sums + other.squared_sums
+        total.num_histories = self.num_histories + other.num_histories
+        if (self.num_batches is None) != (other.num_batches is None):
+            raise ValueError("Cannot add a tally of batches to a tally of histories")
+        if self.num_batches is not None:
+            total.num_batches = self.num_batches + other.num_batches
+        return total
+
+    def make_batch(self):
+        # The whole tally as a single sample, for histories that are not independent of each other (randomized
+        # quasi-Monte Carlo). Batches add up, the relative error then comes from the spread of their means, weighted by
+        # their number of histories.
+        batch = type(self)(self.num_buckets, self.num_buckets * self.bucket_width)
+        batch.sums = self.sums.copy()
+        batch.squared_sums = self.sums ** 2 / self.num_histories
+        batch.num_histories = self.num_histories
+        batch.num_batches = 1
+        return batch
+
+    def get_mean(self):
+        return self.sums / self.num_histories
+
+    def get_relative_error(self):
+        mean = self.get_mean()
+        num_batches = self.num_histories if self.num_batches is None else self.num_batches
+        if num_batches < 2:
+            return np.full(self.num_buckets, np.nan)
+        variance_of_mean = (self.squared_sums / self.num_histories - mean ** 2) / (num_batches - 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(mean > 0, np.sqrt(np.maximum(variance_of_mean, 0)) / mean, np.nan)
+
+    def normalize(self, cross_sections=1, source_intensity=1):
+        # Score per source particle per cm, divided by the cross section of each bin for collision estimators
+        return self.get_mean() * source_intensity / (self.bucket_width * cross_sections)
+
+
+class TrackLengthTally(HistogramTally):
+    # Track-length estimator of the flux: every flight segment scores its path length inside each bin it crosses.
+    # A segment scores a partial length in its first and last bins and the same length in every bin in between, so
+    # the bins in between are filled with a difference array and a cumulative sum instead of one score per bin.
+    HISTORY_BLOCK_CELLS = 2 ** 20
+
+    def score(self, num_histories, start_x, end_x, track_lengths, histories, weights=None):
+        # weights scale the whole path length of every segment
+        if weights is not None:
+            track_lengths = track_lengths * weights
+        length = self.num_buckets * self.bucket_width
+        low_x = np.clip(np.minimum(start_x, end_x), 0, length)
+        high_x = np.clip(np.maximum(start_x, end_x), 0, length)
+        first_buckets = self.get_bucket_numbers(low_x)
+        last_buckets = self.get_bucket_numbers(high_x)
+
+        # Path length per cm along x. A flight parallel to the slab faces scores its whole length in its bin.
+        distances_x = np.abs(end_x - start_x)
+        parallel = distances_x == 0
+        lengths_per_x = np.divide(track_lengths, distances_x, out=np.zeros_like(track_lengths), where=~parallel)
+        single_bucket = first_buckets == last_buckets
+        first_scores = np.where(single_bucket, (high_x - low_x) * lengths_per_x,
+                                ((first_buckets + 1) * self.bucket_width - low_x) * lengths_per_x)
+        first_scores[parallel] = track_lengths[parallel]
+        last_scores = np.where(single_bucket, 0, (high_x - last_buckets * self.bucket_width) * lengths_per_x)
+        inner_scores = np.where(single_bucket, 0, self.bucket_width * lengths_per_x)
+
+        # Histories in blocks of dense (history, bin) arrays
+        order = np.argsort(histories, kind="stable")
+        histories = np.asarray(histories)[order]
+        block_size = max(1, self.HISTORY_BLOCK_CELLS // self.num_buckets)
+        block_starts = np.searchsorted(histories, np.arange(0, num_histories + block_size, block_size))
+        for block, (start, stop) in enumerate(zip(block_starts[:-1], block_starts[1:])):
+            if start == stop:
+                continue
+            block_tracks = order[start:stop]
+            rows = (histories[start:stop] - block * block_size) * (self.num_buckets + 1)
+            size = block_size * (self.num_buckets + 1)
+            inner = inner_scores[block_tracks]
+            steps = (np.bincount(rows + first_buckets[block_tracks] + 1, inner, size)
+                     - np.bincount(rows + last_buckets[block_tracks], inner, size))
+            history_scores = (np.cumsum(steps.reshape(block_size, -1), axis=1)
+                              + np.bincount(rows + first_buckets[block_tracks], first_scores[block_tracks], size)
+                              .reshape(block_size, -1)
+                              + np.bincount(rows + last_buckets[block_tracks], last_scores[block_tracks], size)
+                              .reshape(block_size, -1))[:, :-1]
+            self.sums += history_scores.sum(axis=0)
+            self.squared_sums += (history_scores ** 2).sum(axis=0)
+        self.num_histories += num_histories
+        return self
+
+
+class ExpectedValueTally(HistogramTally):
+    # Expected value (next event) estimator of the uncollided flux, the flux that produces the first collisions:
+    # instead of the site its first collision happened to fall in, every history scores the expected track length of
+    # its first flight in every bin, from the optical depth along it. The estimate then only varies with the source
+    # neutrons, a point source converges with a handful of histories.
+
+    def score(self, num_histories, geometry, positions_x, directions_x, cross_sections):
+        # One source neutron per history: x, direction along x and (histories, regions) total cross sections
+        bin_edges = np.arange(self.num_buckets + 1) * self.bucket_width
+        sources, counts = np.unique(np.column_stack((positions_x, directions_x, cross_sections)), axis=0,
+                                    return_counts=True)
+        for source, count in zip(sources, counts):
+            history_scores = geometry.get_uncollided_track_lengths(source[0], source[1], bin_edges, source[2:])
+            self.sums += count * history_scores
+            self.squared_sums += count * history_scores ** 2
+        self.num_histories += num_histories
+        return self
+
+
+def print_relative_error(tally, label):
+    relative_error = tally.get_relative_error()
+    print(f"{label}: {tally.num_histories} histories, relative error median "
+          f"{np.nanmedian(relative_error):.2%}, max {np.nanmax(relative_error):.2%}")
+
+
+def get_scattered_weights(events):
+    # Weight leaving every collision, 0 for analog absorptions
+    return events.collision_weights - events.collision_absorbed_weights
+
+
+def select_collision_flux(events):
+    # Collision estimator of the flux: every collision scores its weight / macroscopic cross section of its media, at
+    # the energy of the neutron
+    return (events.collision_positions, events.collision_histories,
+            events.collision_weights / events.collision_total_cross_sections)
+
+
+def select_first_scattering_flux(events):
+    scattered_weights = get_scattered_weights(events)
+    first_scatterings = (events.collision_numbers == 0) & (scattered_weights > 0)
+    return (events.collision_positions[first_scatterings], events.collision_histories[first_scatterings],
+            scattered_weights[first_scatterings] / events.collision_scattering_cross_sections[first_scatterings])
+
+
+def select_multiple_collision_flux(events):
+    multiple_collisions = events.collision_numbers != 0
+    return (events.collision_positions[multiple_collisions], events.collision_histories[multiple_collisions],
+            events.collision_weights[multiple_collisions]
+            / events.collision_total_cross_sections[multiple_collisions])
+
+
+def select_source_neutrons(events):
+    # For ExpectedValueTally, same expected scores as select_first_scattering_flux
+    return events.geometry, events.source_positions_x, events.source_directions_x, events.source_cross_sections
+
+
+def select_tracks(events):
+    return (events.track_start_x, events.track_end_x, events.track_lengths, events.track_histories,
+            events.track_weights)
+
+
+def select_collision_sites(events):
+    return events.collision_positions, events.collision_histories, events.collision_weights
+
+
+def select_first_scattering_sites(events):
+    scattered_weights = get_scattered_weights(events)
+    first_scatterings = (events.collision_numbers == 0) & (scattered_weights > 0)
+    return (events.collision_positions[first_scatterings], events.collision_histories[first_scatterings],
+            scattered_weights[first_scatterings])
+
+
+def select_multiple_collision_sites(events):
+    multiple_collisions = events.collision_numbers != 0
+    return (events.collision_positions[multiple_collisions], events.collision_histories[multiple_collisions],
+            events.collision_weights[multiple_collisions])
+
+
+def select_absorption_sites(events):
+    absorptions = events.collision_absorbed_weights > 0
+    return (events.collision_positions[absorptions], events.collision_histories[absorptions],
+            events.collision_absorbed_weights[absorptions])
+
+
+def select_thermalization_sites(events):
+    return (events.collision_positions[events.collision_thermalized],
+            events.collision_histories[events.collision_thermalized],
+            get_scattered_weights(events)[events.collision_thermalized])
+
+
+def score_tallies(events, tallies):
+    # tallies: (select_sites, num_buckets) pairs, or (select_sites, num_buckets, tally_class) for other estimators,
+    # e.g. (select_tracks, 60, TrackLengthTally)
+    num_histories = events.results.size
+    return [(tally_class[0] if tally_class else HistogramTally)(num_buckets).score(num_histories, *select_sites(events))
+            for select_sites, num_buckets, *tally_class in tallies]
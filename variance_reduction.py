@@ -0,0 +1,42 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Survival biasing: a collision never kills the neutron, its weight is multiplied by the scattering ratio and the
+# absorbed part is scored. Below low, Russian roulette keeps the neutron with probability weight / survival, at the
+# survival weight. Above high, the neutron is split in copies that share its weight. The weights of a history always
+# add up to the analog expectation, so every tally must score the weights.
+WeightWindow = namedtuple("WeightWindow", ["low", "survival", "high"])
+DEFAULT_WEIGHT_WINDOW = WeightWindow(low=0.25, survival=0.5, high=2.0)
+
+
+def play_russian_roulette(weights, uniforms, weight_window):
+    # Returns which neutrons survive and the weights of all of them
+    below = weights < weight_window.low
+    survived = ~below | (uniforms * weight_window.survival < weights)
+    return survived, np.where(below, weight_window.survival, weights)
+
+
+def get_split_counts(weights, weight_window):
+    # Number of copies of every neutron, 1 inside the window
+    return np.where(weights > weight_window.high, np.ceil(weights / weight_window.high), 1).astype(int)
+
+
+def get_importance_split_counts(importance_ratios, uniforms):
+    # Geometry splitting: a neutron that moved to a region importance_ratios times as important goes on as
+    # floor(ratio) or floor(ratio) + 1 copies, ratio on average, each with its weight divided by the ratio. Below 1
+    # this is Russian roulette, no copy with probability 1 - ratio.
+    return np.floor(importance_ratios + uniforms).astype(int)
+
+
+def split_particles(split_counts, *arrays):
+    # Every array of the particle bank, repeated split_counts times, copies next to each other
+    return [np.repeat(array, split_counts, axis=0) for array in arrays]
+
+
+def get_split_uniforms(split_counts, uniforms):
+    # One uniform per copy for the games played after a split: copy k of n gets (u + k / n) mod 1. Every copy still
+    # sees a uniform, but the copies no longer survive or die together on the same one.
+    copy_counts = np.repeat(split_counts, split_counts)
+    copy_indices = np.arange(copy_counts.size) - np.repeat(np.cumsum(split_counts) - split_counts, split_counts)
+    return (np.repeat(uniforms, split_counts) + copy_indices / copy_counts) % 1
@@ -0,0 +1,28 @@
+import numpy as np
+
+# Variates are generated with numpy in blocks and handed out one by one to the per-history engines, which only
+# need a single number at a time. Each kind of variate has its own buffer, refilled when it runs empty.
+BLOCK_SIZE = 4096
+
+
+class VariatePool:
+    def __init__(self, generator=None, block_size=BLOCK_SIZE):
+        self.generator = np.random.default_rng() if generator is None else generator
+        self.block_size = block_size
+        self.uniforms = []
+        self.exponentials = []
+
+    def random(self):
+        if not self.uniforms:
+            self.uniforms = self.generator.random(self.block_size).tolist()
+        return self.uniforms.pop()
+
+    def standard_exponential(self):
+        if not self.exponentials:
+            self.exponentials = self.generator.standard_exponential(self.block_size).tolist()
+        return self.exponentials.pop()
+
+
+# Shared by every per-history engine called without an explicit rng. Worker processes must not rely on it, a forked
+# worker inherits a copy of its state.
+default_pool = VariatePool()